@@ -1,5 +1,9 @@
 import argparse
-from consts import DEFAULT_PORT, STR_TO_ROLE
+from consts import DEFAULT_PORT, DEFAULT_RELAY_PORT, DEFAULT_RECV_BUDGET, HEARTBEAT_INTERVAL, DEFAULT_MOVE_QUEUE_LEN, DEFAULT_INPUT_BURST, MAP_PATH, STR_TO_ROLE
+from cman_protocol import DEFAULT_KEYFRAME_INTERVAL
+from cman_metrics import DEFAULT_METRICS_INTERVAL
+from cman_ghost_bot import DEFAULT_GHOST_BOT_HZ, GHOST_BOT_JOIN_DELAY
+from cman_relay_impl import DEFAULT_RELAY_IDLE_TIMEOUT
 
 class ArgParser:
 
@@ -15,8 +19,159 @@ class ArgParser:
             default=DEFAULT_PORT,
             help=f"The port number the server should listen on (default: {DEFAULT_PORT})"
         )
+        parser.add_argument(
+            "-w", "--workers",
+            type=int,
+            default=1,
+            help="The number of worker processes sharing the port with SO_REUSEPORT (default: 1)"
+        )
+        parser.add_argument(
+            "--engine",
+            type=str,
+            default="select",
+            choices=["select", "asyncio", "uvloop"],
+            help="The event loop the server runs on; uvloop must be installed to use it (default: select)"
+        )
+        parser.add_argument(
+            "--tick-hz",
+            type=float,
+            default=None,
+            help="Send at most this many state updates per second, only when the state changed (default: after every datagram)"
+        )
+        parser.add_argument(
+            "--recv-budget",
+            type=int,
+            default=DEFAULT_RECV_BUDGET,
+            help=f"The most datagrams handled per wakeup before broadcasting (default: {DEFAULT_RECV_BUDGET})"
+        )
+        parser.add_argument(
+            "--keyframe-interval",
+            type=int,
+            default=DEFAULT_KEYFRAME_INTERVAL,
+            help=f"Send a full state to delta clients every this many state changes (default: {DEFAULT_KEYFRAME_INTERVAL})"
+        )
+        parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=None,
+            help="Evict clients that sent nothing for this many seconds (default: never)"
+        )
+        parser.add_argument(
+            "--metrics-file",
+            type=str,
+            default=None,
+            help="Write metrics as JSON to this file periodically; workers add their id to the name (default: none)"
+        )
+        parser.add_argument(
+            "--metrics-interval",
+            type=float,
+            default=DEFAULT_METRICS_INTERVAL,
+            help=f"How often the metrics file is written, in seconds (default: {DEFAULT_METRICS_INTERVAL})"
+        )
+        parser.add_argument(
+            "--record",
+            type=str,
+            default=None,
+            help="Record accepted JOIN, move and QUIT messages to this file for cman_replay.py; workers add their id to the name (default: none)"
+        )
+        parser.add_argument(
+            "--ghost-bot",
+            type=float,
+            default=None,
+            metavar="DIFFICULTY",
+            help=f"Let a server-side bot play the ghost when no ghost client joined within {GHOST_BOT_JOIN_DELAY:g}s of the cman. "
+                 "DIFFICULTY, from 0 to 1, is how often it takes the shortest path to the cman instead of a random turn (default: no bot)"
+        )
+        parser.add_argument(
+            "--ghost-bot-hz",
+            type=float,
+            default=DEFAULT_GHOST_BOT_HZ,
+            help=f"How many moves a second the ghost bot makes (default: {DEFAULT_GHOST_BOT_HZ:g})"
+        )
+        parser.add_argument(
+            "--move-hz",
+            type=float,
+            default=None,
+            help="Queue moves and apply at most this many per player per second (default: apply moves as they arrive)"
+        )
+        parser.add_argument(
+            "--move-queue",
+            type=int,
+            default=DEFAULT_MOVE_QUEUE_LEN,
+            help=f"With --move-hz, the most moves queued per player; moves beyond it are dropped (default: {DEFAULT_MOVE_QUEUE_LEN})"
+        )
+        parser.add_argument(
+            "--input-rate",
+            type=float,
+            default=None,
+            help="Drop moves from an address beyond this many per second on average (default: no limit)"
+        )
+        parser.add_argument(
+            "--input-burst",
+            type=int,
+            default=DEFAULT_INPUT_BURST,
+            help=f"With --input-rate, how many moves an address may send at once (default: {DEFAULT_INPUT_BURST})"
+        )
+
+        args = parser.parse_args()
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        # Idle clients heartbeat every HEARTBEAT_INTERVAL, so a shorter timeout would evict them for one lost heartbeat.
+        if args.idle_timeout is not None and args.idle_timeout <= 2 * HEARTBEAT_INTERVAL:
+            parser.error(f"--idle-timeout must be more than {2 * HEARTBEAT_INTERVAL:g} seconds")
+        if args.tick_hz is not None and args.tick_hz <= 0:
+            parser.error("--tick-hz must be positive")
+        if args.recv_budget < 1:
+            parser.error("--recv-budget must be at least 1")
+        if args.keyframe_interval < 1:
+            parser.error("--keyframe-interval must be at least 1")
+        if args.ghost_bot is not None and not 0 <= args.ghost_bot <= 1:
+            parser.error("--ghost-bot must be between 0 and 1")
+        if args.ghost_bot_hz <= 0:
+            parser.error("--ghost-bot-hz must be positive")
+        for name, value in (("--move-hz", args.move_hz), ("--input-rate", args.input_rate)):
+            if value is not None and value <= 0:
+                parser.error(f"{name} must be positive")
+        if args.move_queue < 1 or args.input_burst < 1:
+            parser.error("--move-queue and --input-burst must be at least 1")
+        return args
+
+    def relay_parse_arguments(self):
+        parser = self._create_parser("A relay script that re-broadcasts a server's updates to its own spectators.")
 
-        return parser.parse_args().port
+        parser.add_argument(
+            "addr",
+            type=str,
+            help="The address of the upstream server or relay (e.g., 127.0.0.1)"
+        )
+        parser.add_argument(
+            "-p", "--port",
+            type=int,
+            default=DEFAULT_PORT,
+            help=f"The upstream port number (default: {DEFAULT_PORT})"
+        )
+        parser.add_argument(
+            "-l", "--listen-port",
+            type=int,
+            default=DEFAULT_RELAY_PORT,
+            help=f"The port number the relay should listen on (default: {DEFAULT_RELAY_PORT})"
+        )
+        parser.add_argument(
+            "-r", "--room",
+            type=int,
+            default=None,
+            help="The upstream room to relay (default: the server's default room)"
+        )
+        parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=DEFAULT_RELAY_IDLE_TIMEOUT,
+            help=f"Drop watchers that sent nothing for this many seconds (default: {DEFAULT_RELAY_IDLE_TIMEOUT:g})"
+        )
+        args = parser.parse_args()
+        if args.idle_timeout <= 2 * HEARTBEAT_INTERVAL:
+            parser.error(f"--idle-timeout must be more than {2 * HEARTBEAT_INTERVAL:g} seconds")
+        return args.addr, args.port, args.listen_port, args.room, args.idle_timeout
 
     def client_parse_arguments(self):
         parser = self._create_parser("A client script for connecting to a server.")
@@ -38,5 +193,148 @@ class ArgParser:
             default=DEFAULT_PORT,
             help=f"The port number to connect to (default: {DEFAULT_PORT})"
         )
+        parser.add_argument(
+            "-r", "--room",
+            type=int,
+            default=None,
+            help="The room to join (default: the server's default room)"
+        )
+        parser.add_argument(
+            "--max-fps",
+            type=float,
+            default=None,
+            help="Redraw the screen at most this many times per second (default: no limit)"
+        )
+        args = parser.parse_args()
+        return STR_TO_ROLE[args.role], args.addr, args.port, args.room, args.max_fps
+
+    def map_cache_parse_arguments(self):
+        parser = self._create_parser("Compiles maps into the binary cache the server and clients load them from.")
+
+        parser.add_argument(
+            "maps",
+            type=str,
+            nargs='*',
+            default=[MAP_PATH],
+            help=f"The map files to compile (default: {MAP_PATH})"
+        )
+        parser.add_argument(
+            "-f", "--force",
+            action="store_true",
+            help="Recompile even if the cache is up to date"
+        )
+        args = parser.parse_args()
+        return args.maps, args.force
+
+    def batch_sim_parse_arguments(self):
+        parser = self._create_parser("Verifies the batch game simulator against Game and measures its throughput.")
+
+        parser.add_argument(
+            "-g", "--games",
+            type=int,
+            default=4096,
+            help="The number of games stepped in lockstep (default: 4096)"
+        )
+        parser.add_argument(
+            "-s", "--steps",
+            type=int,
+            default=1000,
+            help="The number of steps to time (default: 1000)"
+        )
+        parser.add_argument(
+            "--verify-steps",
+            type=int,
+            default=2000,
+            help="The number of steps checked against Game, on at most 256 games (default: 2000)"
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="The seed of the random moves (default: 0)"
+        )
+        args = parser.parse_args()
+        return args.games, args.steps, args.verify_steps, args.seed
+
+    def loadgen_parse_arguments(self):
+        parser = self._create_parser("A load generator that runs many simulated clients against a server.")
+
+        parser.add_argument(
+            "addr",
+            type=str,
+            help="The server address (e.g., 127.0.0.1)"
+        )
+        parser.add_argument(
+            "-p", "--port",
+            type=int,
+            default=DEFAULT_PORT,
+            help=f"The server port (default: {DEFAULT_PORT})"
+        )
+        parser.add_argument(
+            "--rooms",
+            type=int,
+            default=100,
+            help="The number of rooms, each with a cman and a ghost (default: 100)"
+        )
+        parser.add_argument(
+            "--spectators",
+            type=int,
+            default=1,
+            help="The number of spectators in each room (default: 1)"
+        )
+        parser.add_argument(
+            "--move-hz",
+            type=float,
+            default=10.0,
+            help="How many moves each player sends per second (default: 10)"
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="How many seconds to run for (default: 10)"
+        )
+        parser.add_argument(
+            "--first-room",
+            type=int,
+            default=0,
+            help="The id of the first room used (default: 0)"
+        )
+        args = parser.parse_args()
+        return args.addr, args.port, args.rooms, args.spectators, args.move_hz, args.duration, args.first_room
+
+    def stats_parse_arguments(self):
+        parser = self._create_parser("Print the metrics of a local Cman server.")
+        parser.add_argument(
+            "addr",
+            type=str,
+            nargs="?",
+            default="127.0.0.1",
+            help="The server address; stats are only served on loopback (default: 127.0.0.1)"
+        )
+        parser.add_argument(
+            "-p", "--port",
+            type=int,
+            default=DEFAULT_PORT,
+            help=f"The server port (default: {DEFAULT_PORT})"
+        )
+        args = parser.parse_args()
+        return args.addr, args.port
+
+    def replay_parse_arguments(self):
+        parser = self._create_parser("Replay a recording made with cman_server.py --record.")
+        parser.add_argument(
+            "recording",
+            type=str,
+            help="The recording file"
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=0.0,
+            help="Replay at this multiple of the recorded pace, e.g. 1 for real time; 0 replays as fast as possible (default: 0)"
+        )
         args = parser.parse_args()
-        return STR_TO_ROLE[args.role], args.addr, args.port
\ No newline at end of file
+        if args.speed < 0:
+            parser.error("--speed must not be negative")
+        return args.recording, args.speed
\ No newline at end of file
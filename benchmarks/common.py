@@ -0,0 +1,38 @@
+import contextlib
+import io
+import socket
+import time
+
+from cman_server_impl import CManServer
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def fake_address(index):
+    """Loopback addresses nobody listens on, used as stand-ins for remote clients."""
+    return ('127.0.0.1', 20000 + index % 40000)
+
+
+def make_server():
+    """Creates a CManServer with a bound loopback socket, without running its loop."""
+    server = CManServer(0)
+    server.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.server_socket.bind(('127.0.0.1', 0))
+    return server
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
@@ -0,0 +1,122 @@
+"""
+
+Compares the server engines end to end over loopback UDP.
+
+Each engine is started as a real cman_server.py process. Every room gets a cman and a
+ghost, then in every round each player sends one move and the round ends once every
+player has received a state update back. Run from the repo root:
+
+    python -m benchmarks.engines
+
+"""
+import argparse
+import importlib.util
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+from cman_game import Direction
+from benchmarks.common import percentile
+
+# Rounds that do not complete by then (a datagram was dropped) are counted as lost.
+ROUND_TIMEOUT = 0.25
+
+
+def _available_engines():
+    engines = ['select', 'asyncio']
+    if importlib.util.find_spec('uvloop') is not None:
+        engines.append('uvloop')
+    return engines
+
+
+def _start_server(engine, port):
+    server = subprocess.Popen([sys.executable, 'cman_server.py', '-p', str(port), '--engine', engine],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    return server
+
+
+def _join_rooms(port, room_count):
+    players = []
+    for room_id in range(room_count):
+        room_bytes = room_id.to_bytes(2, 'big')
+        for role in (0x01, 0x02):
+            player = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            player.connect(('127.0.0.1', port))
+            player.send(bytes([0x00, role]) + room_bytes)
+            players.append(player)
+    return players
+
+
+def _drain(selector, players, deadline):
+    waiting = set(players)
+    while waiting and time.perf_counter() < deadline:
+        for key, _ in selector.select(deadline - time.perf_counter()):
+            try:
+                while True:
+                    key.fileobj.recv(1024)
+                    waiting.discard(key.fileobj)
+            except BlockingIOError:
+                pass
+    return not waiting
+
+
+def run(engine, port, room_count, rounds):
+    server = _start_server(engine, port)
+    players = _join_rooms(port, room_count)
+    selector = selectors.DefaultSelector()
+    for player in players:
+        player.setblocking(False)
+        selector.register(player, selectors.EVENT_READ)
+    _drain(selector, players, time.perf_counter() + ROUND_TIMEOUT)
+
+    # Cman and the ghost shuffle between two cells each and never meet, so no game ends.
+    moves = [[bytes([0x01, Direction.RIGHT]), bytes([0x01, Direction.LEFT])],
+             [bytes([0x01, Direction.LEFT]), bytes([0x01, Direction.RIGHT])]]
+    samples = []
+    lost_rounds = 0
+    for round_index in range(rounds):
+        start = time.perf_counter()
+        for index, player in enumerate(players):
+            player.send(moves[index % 2][round_index % 2])
+        if not _drain(selector, players, start + ROUND_TIMEOUT):
+            lost_rounds += 1
+        samples.append(time.perf_counter() - start)
+
+    server.terminate()
+    server.wait()
+    selector.close()
+    for player in players:
+        player.close()
+
+    samples.sort()
+    return {
+        'engine': engine,
+        'rooms': room_count,
+        'packets_per_sec': len(players) * rounds / sum(samples),
+        'p50_ms': percentile(samples, 0.50) * 1e3,
+        'p99_ms': percentile(samples, 0.99) * 1e3,
+        'lost_rounds': lost_rounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round trip throughput and latency of each server engine.")
+    parser.add_argument("--engines", nargs='+', default=_available_engines())
+    parser.add_argument("--rooms", type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--port", type=int, default=14500)
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'rooms':>6} {'pkt/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'lost':>5}")
+    for room_count in args.rooms:
+        for engine in args.engines:
+            result = run(engine, args.port, room_count, args.rounds)
+            print(f"{result['engine']:>8} {result['rooms']:>6} {result['packets_per_sec']:>10.0f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['lost_rounds']:>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+
+Compares Game.apply_move on the compiled board against the string-board version it
+replaced, kept here as LegacyGame. Both games replay the same random moves, and
+their states are checked against each other before timing. Run from the repo root:
+
+    python -m benchmarks.moves
+
+"""
+import argparse
+import random
+import time
+
+import cman_game_map as gm
+from consts import MAP_PATH
+from cman_game import Game, Player, Direction, State, WIN_SCORE
+from benchmarks.common import quiet
+
+
+class LegacyGame(Game):
+    __slots__ = ('legacy_coords',)
+
+    def restart_game(self):
+        super().restart_game()
+        self.legacy_coords = self.start_coords[::]
+
+    def next_round(self):
+        super().next_round()
+        self.legacy_coords = self.start_coords[::]
+
+    def apply_move(self, player, direction):
+        if not self.can_move(player):
+            return False
+
+        p_coords = self.legacy_coords[player]
+        dr = -1 if direction == Direction.UP else 1 if direction == Direction.DOWN else 0
+        dc = -1 if direction == Direction.LEFT else 1 if direction == Direction.RIGHT else 0
+        next_coords = (p_coords[0] + dr, p_coords[1] + dc)
+
+        if any(x < 0 for x in next_coords) or next_coords[0] >= self.board_dims[0] or next_coords[1] >= self.board_dims[1]:
+            return False
+        if self.board[next_coords[0]][next_coords[1]] not in gm.PASS_CHARS:
+            return False
+        else:
+            self.state = State.PLAY
+            self.legacy_coords[player] = next_coords
+            self.version += 1
+            if player == Player.CMAN and next_coords in self.points.keys():
+                self.score += self.points[next_coords]
+                self.points[next_coords] = 0
+                self.collected_points |= self.point_bits[next_coords]
+                if self.score >= WIN_SCORE:
+                    self.declare_winner(Player.CMAN)
+            if (player == Player.CMAN and next_coords in self.legacy_coords[1:]) or (player != Player.CMAN and next_coords == self.legacy_coords[0]):
+                self.lives -= 1
+                if self.lives <= 0:
+                    self.declare_winner(Player.SPIRIT)
+                else:
+                    self.next_round()
+            return True
+
+
+def _random_moves(count, seed=0):
+    rng = random.Random(seed)
+    return [(Player(rng.randrange(2)), Direction(rng.randrange(4))) for _ in range(count)]
+
+
+def _replay(game, moves):
+    game.restart_game()
+    game.next_round()
+    for player, direction in moves:
+        if game.get_winner() != Player.NONE:
+            game.restart_game()
+            game.next_round()
+        game.apply_move(player, direction)
+
+
+def _verify(moves):
+    legacy, compiled = LegacyGame(MAP_PATH), Game(MAP_PATH)
+    legacy.restart_game()
+    compiled.restart_game()
+    legacy.next_round()
+    compiled.next_round()
+    for player, direction in moves:
+        if legacy.get_winner() != Player.NONE:
+            for game in (legacy, compiled):
+                game.restart_game()
+                game.next_round()
+        assert legacy.apply_move(player, direction) == compiled.apply_move(player, direction)
+        assert legacy.legacy_coords == compiled.cur_coords
+        assert (legacy.score, legacy.lives, legacy.state, legacy.collected_points) == \
+               (compiled.score, compiled.lives, compiled.state, compiled.collected_points)
+
+
+def run(move_count):
+    moves = _random_moves(move_count)
+    with quiet():
+        _verify(moves[:20000])
+        results = {}
+        for name, game in (('legacy', LegacyGame(MAP_PATH)), ('compiled', Game(MAP_PATH))):
+            start = time.perf_counter()
+            _replay(game, moves)
+            results[name] = move_count / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moves per second of Game.apply_move, before and after compiling the board.")
+    parser.add_argument("--moves", type=int, default=500000)
+    args = parser.parse_args()
+
+    results = run(args.moves)
+    print(f"legacy apply_move:   {results['legacy']:>10.0f} moves/s")
+    print(f"compiled apply_move: {results['compiled']:>10.0f} moves/s")
+    print(f"speedup: {results['compiled'] / results['legacy']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
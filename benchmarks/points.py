@@ -0,0 +1,51 @@
+"""
+
+Compares the old per-send conversion of Game.points into the 5 wire bytes against
+the bitmask Game maintains incrementally. Run from the repo root:
+
+    python -m benchmarks.points
+
+"""
+import argparse
+import random
+import timeit
+
+from consts import MAP_PATH
+from cman_game import Game
+from cman_server_impl import _convert_point_map_to_byte_stream
+
+
+def _half_collected_game():
+    game = Game(MAP_PATH)
+    for coord in random.Random(0).sample(sorted(game.points), len(game.points) // 2):
+        game.points[coord] = 0
+        game.collected_points |= game.point_bits[coord]
+    assert bytes(_convert_point_map_to_byte_stream(game.get_points())) == game.get_collected_points_bytes()
+    return game
+
+
+def run(number):
+    game = _half_collected_game()
+    points = game.get_points()
+    converted = timeit.timeit(lambda: _convert_point_map_to_byte_stream(points), number=number)
+    bitmask = timeit.timeit(game.get_collected_points_bytes, number=number)
+    return {
+        'convert_point_map_us': converted / number * 1e6,
+        'collected_points_bytes_us': bitmask / number * 1e6,
+        'speedup': converted / bitmask,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Point bitmap encoding: dict conversion vs. maintained bitmask.")
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    result = run(args.number)
+    print(f"_convert_point_map_to_byte_stream: {result['convert_point_map_us']:.2f} us/call")
+    print(f"Game.get_collected_points_bytes:   {result['collected_points_bytes_us']:.2f} us/call")
+    print(f"speedup: {result['speedup']:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+
+Measures how many rooms a single server process can serve and how per-packet
+latency grows with the room count.
+
+Every room gets a cman, a ghost and a spectator, then moves are fed straight into
+CManServer._handle_datagram in a round-robin over the rooms. Run from the repo root:
+
+    python -m benchmarks.rooms
+
+"""
+import argparse
+
+from cman_game import Direction
+from benchmarks.common import fake_address, make_server, percentile, quiet, timed
+
+# Each room is assumed to receive this many datagrams per second from its two players.
+PACKETS_PER_ROOM_PER_SEC = 20
+
+
+def _join_rooms(server, room_count):
+    players = []
+    for room_id in range(room_count):
+        cman, ghost, watcher = (fake_address(3 * room_id + i) for i in range(3))
+        room_bytes = room_id.to_bytes(2, 'big')
+        server._handle_datagram(bytes([0x00, 0x00]) + room_bytes, watcher)
+        server._handle_datagram(bytes([0x00, 0x01]) + room_bytes, cman)
+        server._handle_datagram(bytes([0x00, 0x02]) + room_bytes, ghost)
+        players.append((cman, ghost))
+    return players
+
+
+def _move_sequence(players, packet_count):
+    # Cman and the ghost shuffle between two cells each and never meet, so no game ends.
+    cman_moves = [bytes([0x01, Direction.RIGHT]), bytes([0x01, Direction.LEFT])]
+    ghost_moves = [bytes([0x01, Direction.LEFT]), bytes([0x01, Direction.RIGHT])]
+    sequence = []
+    for i in range(packet_count):
+        cman, ghost = players[(i // 2) % len(players)]
+        step = (i // (2 * len(players))) % 2
+        if i % 2 == 0:
+            sequence.append((cman_moves[step], cman))
+        else:
+            sequence.append((ghost_moves[step], ghost))
+    return sequence
+
+
+def run(room_count, packet_count):
+    server = make_server()
+    with quiet():
+        players = _join_rooms(server, room_count)
+        sequence = _move_sequence(players, packet_count)
+        samples = sorted(timed(server._handle_datagram, data, address) for data, address in sequence)
+    server.server_socket.close()
+
+    total = sum(samples)
+    packets_per_sec = len(samples) / total
+    return {
+        'rooms': room_count,
+        'packets_per_sec': packets_per_sec,
+        'rooms_per_core': packets_per_sec / PACKETS_PER_ROOM_PER_SEC,
+        'p50_us': percentile(samples, 0.50) * 1e6,
+        'p99_us': percentile(samples, 0.99) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rooms per core and per-packet latency by room count.")
+    parser.add_argument("--rooms", type=int, nargs='+', default=[1, 10, 100, 500, 1000])
+    parser.add_argument("--packets", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'rooms':>6} {'pkt/s':>10} {'rooms/core':>11} {'p50 us':>8} {'p99 us':>8}")
+    for room_count in args.rooms:
+        result = run(room_count, args.packets)
+        print(f"{result['rooms']:>6} {result['packets_per_sec']:>10.0f} {result['rooms_per_core']:>11.0f} "
+              f"{result['p50_us']:>8.1f} {result['p99_us']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+
+Microbenchmarks of the protocol, game and client hot paths, with a saved baseline and
+regression thresholds. Everything runs in process, without sockets. Run from the repo root:
+
+    python -m benchmarks                     # compare against benchmarks/baseline.json
+    python -m benchmarks --json              # the same, as JSON on stdout
+    python -m benchmarks --save-baseline     # record this machine's numbers as the baseline
+
+The exit status is 1 when a case got slower than its baseline by more than the threshold. Timings only
+compare on the machine that took them, so the baseline is not committed: it records the machine and
+Python it was taken on, and a baseline from anywhere else is shown but flags no regressions.
+
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+from consts import MAP_PATH, GAME_END
+from cman_game import Game, Player, Direction
+from cman_room import Room
+from cman_protocol import SEQ_MODULO
+from cman_server_impl import _convert_point_map_to_byte_stream, _create_bytes_message
+from cman_client_impl import Client
+from cman_ghost_bot import GhostBot, next_step_table
+from client_map import WorldMap
+from benchmarks.common import quiet
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_THRESHOLD = 0.3
+REPEATS = 7
+MIN_RUN_SECONDS = 0.1
+
+CASES = {}
+
+
+def case(fn):
+    """Registers a benchmark case: fn does its setup and returns the callable that is timed."""
+    CASES[fn.__name__] = fn
+    return fn
+
+
+def _playing_game():
+    game = Game(MAP_PATH)
+    game.next_round()
+    return game
+
+
+def _oscillate(game):
+    # Cman steps right and back forever, picking up nothing new after the first step.
+    moves = [Direction.RIGHT, Direction.LEFT]
+    state = {'step': 0}
+
+    def move():
+        state['step'] ^= 1
+        return game.apply_move(Player.CMAN, moves[state['step']])
+    return move
+
+
+@case
+def convert_point_map():
+    points = Game(MAP_PATH).get_points()
+    return lambda: _convert_point_map_to_byte_stream(points)
+
+
+@case
+def create_bytes_message():
+    return lambda: _create_bytes_message(GAME_END, 0x01, 2, 17)
+
+
+@case
+def send_game_stats_encoding():
+    # What _send_game_stats encodes per room after a move: the full update once, and a delta per acked base.
+    room = Room(0, MAP_PATH)
+    room.game.next_round()
+    move = _oscillate(room.game)
+
+    def encode():
+        move()
+        room.state_encoder.encode(room.game)
+        room.delta_encoder.update(room.game)
+        # A client that acked the previous state, the common case.
+        room.delta_encoder.encode((room.delta_encoder.seq - 1) % SEQ_MODULO)
+    return encode
+
+
+@case
+def apply_move():
+    return _oscillate(_playing_game())
+
+
+@case
+def ghost_bot_next_direction():
+    game = _playing_game()
+    bot = GhostBot(next_step_table(MAP_PATH), 0.8)
+    return lambda: bot.next_direction(game)
+
+
+@case
+def restart_game():
+    return Game(MAP_PATH).restart_game
+
+
+@case
+def client_update_map():
+    client = Client(1, ('127.0.0.1', 9))
+    states = [bytes.fromhex('01090c070c000000000000'), bytes.fromhex('00090d070c008000000000')]
+    state = {'index': 0}
+
+    def update():
+        state['index'] ^= 1
+        client._Client__update_map(states[state['index']])
+    return update
+
+
+@case
+def client_get_points_flags():
+    client = Client(1, ('127.0.0.1', 9))
+    collected = bytes.fromhex('a5a5a5a5a5')
+    return lambda: client._Client__get_points_flags(collected)
+
+
+@case
+def worldmap_to_string():
+    return WorldMap(MAP_PATH).to_string
+
+
+def _time_case(fn):
+    # The fastest of several long-enough runs is the least disturbed by the rest of the machine.
+    timer = timeit.Timer(fn)
+    number, taken = timer.autorange()
+    number = max(number, int(number * MIN_RUN_SECONDS / taken))
+    return min(timer.repeat(REPEATS, number)) / number
+
+
+def run(names=None):
+    """Returns the best time per call, in nanoseconds, of every case (or only the named ones)."""
+    results = {}
+    with quiet():
+        for name, setup in CASES.items():
+            if names and name not in names:
+                continue
+            results[name] = _time_case(setup()) * 1e9
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compares results with baseline times; with a threshold of None nothing counts as a regression."""
+    report = {}
+    for name, ns in results.items():
+        baseline_ns = baseline.get(name)
+        ratio = ns / baseline_ns if baseline_ns else None
+        report[name] = {
+            'ns_per_call': ns,
+            'baseline_ns_per_call': baseline_ns,
+            'ratio': ratio,
+            'regressed': threshold is not None and ratio is not None and ratio > 1 + threshold,
+        }
+    return report
+
+
+def _environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'node': platform.node(), 'processor': platform.processor()}
+
+
+def load_baseline(path):
+    """Returns the baseline's environment and times, or None and no times if there is no baseline."""
+    if not os.path.exists(path):
+        return None, {}
+    with open(path) as f:
+        baseline = json.load(f)
+    return baseline.get('environment'), baseline['ns_per_call']
+
+
+def save_baseline(results, path):
+    with open(path, 'w') as f:
+        json.dump({'environment': _environment(), 'ns_per_call': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the protocol, game and client hot paths.")
+    parser.add_argument("cases", nargs='*', help=f"Only run these cases, out of: {', '.join(CASES)}")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="The baseline file, local to this checkout (default: benchmarks/baseline.json)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"The slowdown over the baseline counted as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = run(args.cases)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+
+    environment, baseline = load_baseline(args.baseline)
+    threshold = args.threshold
+    if environment is not None and environment != _environment():
+        print(f"Warning: {args.baseline} was recorded on {environment}, not on this machine, so no case is "
+              f"flagged as a regression. Record this machine's baseline with --save-baseline.", file=sys.stderr)
+        threshold = None
+
+    report = compare(results, baseline, threshold)
+    regressions = [name for name, entry in report.items() if entry['regressed']]
+    if args.json:
+        json.dump({'environment': _environment(), 'threshold': threshold, 'cases': report,
+                   'regressions': regressions}, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(f"{'case':<26} {'ns/call':>10} {'baseline':>10} {'ratio':>7}")
+        for name, entry in report.items():
+            baseline_ns = entry['baseline_ns_per_call']
+            print(f"{name:<26} {entry['ns_per_call']:>10.0f} "
+                  f"{baseline_ns if baseline_ns is not None else float('nan'):>10.0f} "
+                  f"{entry['ratio'] if entry['ratio'] is not None else float('nan'):>7.2f}"
+                  f"{'  REGRESSED' if entry['regressed'] else ''}")
+
+    return 1 if regressions else 0
@@ -1,5 +1,6 @@
 from enum import Enum
 from consts import MAP_PATH
+from cman_map_cache import load_compiled_map
 
 
 class WorldMap:
@@ -11,41 +12,15 @@ class WorldMap:
         GHOST = '∩'
 
     def __init__(self, map_file):
-        self.matrix = self._load_map(map_file)
-        self.__starting_points_indexes = self.__get_point_indexes()
-        self.current_cman_idx = self.__get_cman_index()
-        self.current_ghost_idx = self.__get_ghost_index()
+        compiled_map = load_compiled_map(map_file)
+        self.matrix = [[self.__convert_char(c) for c in line] for line in compiled_map.lines]
+        board = compiled_map.board
+        self.__starting_points_indexes = [board.coords_of(cell) for cell in compiled_map.point_cells]
+        self.current_cman_idx = board.coords_of(compiled_map.start_cells[0])
+        self.current_ghost_idx = board.coords_of(compiled_map.start_cells[1])
+        # Cells written since the last take_dirty_cells(), so a renderer can redraw only those.
+        self.dirty_cells = set()
 
-    def _load_map(self, map_file):
-        matrix = []
-        with open(map_file, 'r') as f:
-            for line in f:
-                strip_line =  line.strip()
-                matrix.append([self.__convert_char(c) for c in strip_line])
-        return matrix
-    
-    def __get_point_indexes(self):
-        point_indexes = []
-        for i, row in enumerate(self.matrix):
-            for j, val in enumerate(row):
-                if val == WorldMap.Entry.POINT.value:
-                    point_indexes.append((i, j))
-        return point_indexes
-    
-    def __get_cman_index(self):
-        for i, row in enumerate(self.matrix):
-            for j, val in enumerate(row):
-                if val == WorldMap.Entry.CMAN.value:
-                    return (i, j)
-        assert False, 'Cman not found'
-    
-    def __get_ghost_index(self):
-        for i, row in enumerate(self.matrix):
-            for j, val in enumerate(row):
-                if val == WorldMap.Entry.GHOST.value:
-                    return (i, j)
-        assert False, 'Ghost not found'
-    
     def get_starting_points_indexes(self):
         return self.__starting_points_indexes
     
@@ -65,23 +40,32 @@ class WorldMap:
     
     def get(self, row, col):
         return self.matrix[row][col]
+
+    def take_dirty_cells(self):
+        dirty_cells, self.dirty_cells = self.dirty_cells, set()
+        return dirty_cells
+
+    def _set(self, row, col, value):
+        if self.matrix[row][col] != value:
+            self.matrix[row][col] = value
+            self.dirty_cells.add((row, col))
     
     def remove_players(self):
-        self.matrix[self.current_cman_idx[0]][self.current_cman_idx[1]] = WorldMap.Entry.FLOOR.value
-        self.matrix[self.current_ghost_idx[0]][self.current_ghost_idx[1]] = WorldMap.Entry.FLOOR.value
+        self._set(*self.current_cman_idx, WorldMap.Entry.FLOOR.value)
+        self._set(*self.current_ghost_idx, WorldMap.Entry.FLOOR.value)
     
     def remove_point(self, row, col):
-        self.matrix[row][col] = ' '
+        self._set(row, col, ' ')
     
     def place_point(self, row, col):
-        self.matrix[row][col] = '·'
+        self._set(row, col, '·')
     
     def place_cman(self, row, col):
-        self.matrix[row][col] = WorldMap.Entry.CMAN.value
+        self._set(row, col, WorldMap.Entry.CMAN.value)
         self.current_cman_idx = (row, col)
 
     def place_ghost(self, row, col):
-        self.matrix[row][col] = WorldMap.Entry.GHOST.value
+        self._set(row, col, WorldMap.Entry.GHOST.value)
         self.current_ghost_idx = (row, col)
     
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from arg_parser import ArgParser as ap
+from consts import MAP_PATH
+from cman_game import Game, Player, State, WIN_SCORE, MAX_ATTEMPTS
+from cman_map_cache import load_compiled_map
+
+# A direction that leaves a game's players where they are for one step.
+NO_MOVE = -1
+
+
+class BatchGame:
+    """
+
+    Steps many games on one map in lockstep with NumPy, following the rules of Game.apply_move.
+
+    Game i is row i of every array: cells (the cman's and the spirit's compiled board cell), collected (the
+    collected points bitmask), score, lives, state (a State value) and winner (a Player value, kept like
+    Game.winner, so only meaningful while state is State.WIN). Requires numpy.
+
+    """
+
+    def __init__(self, count, map_path=MAP_PATH):
+        compiled_map = load_compiled_map(map_path)
+        self.neighbours = np.array(compiled_map.board.neighbours, dtype=np.int32).reshape(-1, 4)
+        self.point_bits = np.array(compiled_map.board.point_bits, dtype=np.int64)
+        self.start_cells = np.array(compiled_map.start_cells, dtype=np.int32)
+        self.count = count
+        self.games = np.arange(count)
+        self.cells = np.empty((count, 2), dtype=np.int32)
+        self.collected = np.zeros(count, dtype=np.int64)
+        self.score = np.zeros(count, dtype=np.int32)
+        self.lives = np.zeros(count, dtype=np.int32)
+        self.state = np.zeros(count, dtype=np.int8)
+        self.winner = np.full(count, Player.NONE, dtype=np.int8)
+        self.restart_games()
+
+    def restart_games(self, mask=None):
+        """Game.restart_game for the games selected by the boolean mask, or for all of them."""
+        games = slice(None) if mask is None else mask
+        self.cells[games] = self.start_cells
+        self.collected[games] = 0
+        self.score[games] = 0
+        self.lives[games] = MAX_ATTEMPTS
+        self.state[games] = State.WAIT
+        self.winner[games] = Player.NONE
+
+    def next_round(self, mask=None):
+        """Game.next_round for the games selected by the boolean mask, or for all of them."""
+        games = slice(None) if mask is None else mask
+        self.cells[games] = self.start_cells
+        self.state[games] = State.START
+
+    def get_winners(self):
+        return np.where(self.state == State.WIN, self.winner, Player.NONE)
+
+    def step(self, players, directions):
+        """
+
+        Applies one move in every game: players[i] moves in directions[i], or stays if it is NO_MOVE.
+
+        Returns:
+
+        numpy.ndarray: A boolean array telling which games changed, like the return value of Game.apply_move
+
+        """
+        players = np.asarray(players)
+        directions = np.asarray(directions)
+
+        can_move = (self.state == State.PLAY) | ((self.state == State.START) & (players == Player.CMAN))
+        next_cells = self.neighbours[self.cells[self.games, players], np.maximum(directions, 0)]
+        moved = can_move & (directions != NO_MOVE) & (next_cells >= 0)
+
+        self.state[moved] = State.PLAY
+        self.cells[self.games[moved], players[moved]] = next_cells[moved]
+
+        cman_moved = moved & (players == Player.CMAN)
+        bits = np.where(cman_moved, self.point_bits[np.maximum(next_cells, 0)], 0)
+        new_bits = bits & ~self.collected
+        self.score += new_bits != 0
+        self.collected |= bits
+        # Like Game, the score is only checked when a new point is collected. A game can go on with a winning
+        # score: when the winning point is on the ghost's cell, the collision's next_round undoes the win.
+        self._declare_winners((new_bits != 0) & (self.score >= WIN_SCORE), Player.CMAN)
+
+        collided = moved & (self.cells[:, 0] == self.cells[:, 1])
+        self.lives -= collided
+        self._declare_winners(collided & (self.lives <= 0), Player.SPIRIT)
+        self.next_round(collided & (self.lives > 0))
+        return moved
+
+    def _declare_winners(self, mask, player):
+        mask = mask & (self.state != State.WIN)
+        self.state[mask] = State.WIN
+        self.winner[mask] = player
+
+
+def _random_moves(rng, count):
+    return rng.integers(0, 2, count), rng.integers(0, 4, count)
+
+
+def _restart_finished(batch, games):
+    finished = batch.state == State.WIN
+    batch.restart_games(finished)
+    batch.next_round(finished)
+    for i in np.flatnonzero(finished):
+        games[i].restart_game()
+        games[i].next_round()
+
+
+def _matches(batch, winners, i, game):
+    return (game.cur_cells == batch.cells[i].tolist()
+            and game.collected_points == batch.collected[i]
+            and (game.score, game.lives, game.state) == (batch.score[i], batch.lives[i], batch.state[i])
+            and game.get_winner() == winners[i])
+
+
+def verify(count, steps, seed=0, map_path=MAP_PATH):
+    """
+
+    Replays the same random moves on a BatchGame and on count Game instances and checks that every game
+    matches after every step. Finished games are restarted in both. Raises AssertionError on the first mismatch.
+
+    """
+    rng = np.random.default_rng(seed)
+    batch = BatchGame(count, map_path)
+    games = [Game(map_path) for _ in range(count)]
+    batch.next_round()
+    for game in games:
+        game.next_round()
+
+    # Game prints every win.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(steps):
+            _restart_finished(batch, games)
+            players, directions = _random_moves(rng, count)
+            moved = batch.step(players, directions)
+            winners = batch.get_winners()
+            for i, game in enumerate(games):
+                applied = game.apply_move(Player(int(players[i])), int(directions[i]))
+                assert applied == moved[i] and _matches(batch, winners, i, game), f"Game {i} diverged from Game at step {step}"
+
+
+def verify_win_on_ghost_cell(map_path=MAP_PATH):
+    """
+
+    Checks a case random moves do not reach: the cman collects its WIN_SCORE-th point on the ghost's cell, the
+    collision starts a new round instead of ending the game, and the cman then walks onto points it already
+    collected, which must not win the game. Raises AssertionError on the first mismatch with Game.
+
+    """
+    compiled_map = load_compiled_map(map_path)
+    board = compiled_map.board
+    # The last point, with the ghost on it and the cman a step away.
+    point_cell = next(cell for cell in compiled_map.point_cells if any(board.neighbours[cell * 4 + d] >= 0 for d in range(4)))
+    direction = next(d for d in range(4) if board.neighbours[point_cell * 4 + d] >= 0)
+    cman_cell = board.neighbours[point_cell * 4 + direction]
+    into_point = next(d for d in range(4) if board.neighbours[cman_cell * 4 + d] == point_cell)
+    collected = sum(board.point_bits) & ~board.point_bits[point_cell]
+
+    batch = BatchGame(1, map_path)
+    game = Game(map_path)
+    batch.cells[0] = (cman_cell, point_cell)
+    game.cur_cells = [cman_cell, point_cell]
+    batch.collected[0] = game.collected_points = collected
+    batch.score[0] = game.score = WIN_SCORE - 1
+    batch.state[0] = game.state = State.PLAY
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for direction in [into_point] + _path_to_point(compiled_map, game.start_cells):
+            moved = batch.step([Player.CMAN], [direction])
+            applied = game.apply_move(Player.CMAN, direction)
+            assert applied == moved[0] and _matches(batch, batch.get_winners(), 0, game), \
+                f"BatchGame diverged from Game after a win on the ghost's cell, moving {direction}"
+    assert game.get_winner() == Player.NONE and game.score == WIN_SCORE
+
+
+def _path_to_point(compiled_map, start_cells):
+    # The directions of a shortest walk from the cman's start to a point cell, around the ghost's start.
+    board = compiled_map.board
+    cman_cell, ghost_cell = start_cells
+    paths = {cman_cell: []}
+    queue = [cman_cell]
+    for cell in queue:
+        if board.point_bits[cell] and cell != cman_cell:
+            return paths[cell]
+        for direction in range(4):
+            next_cell = board.neighbours[cell * 4 + direction]
+            if next_cell >= 0 and next_cell != ghost_cell and next_cell not in paths:
+                paths[next_cell] = paths[cell] + [direction]
+                queue.append(next_cell)
+    raise ValueError("no point cell is reachable from the cman's start")
+
+
+def benchmark(count, steps, seed=0, map_path=MAP_PATH):
+    """Returns the game steps per second of BatchGame and of a loop over Game instances."""
+    rng = np.random.default_rng(seed)
+    moves = [_random_moves(rng, count) for _ in range(steps)]
+
+    batch = BatchGame(count, map_path)
+    batch.next_round()
+    start = time.perf_counter()
+    for players, directions in moves:
+        batch.step(players, directions)
+        finished = batch.state == State.WIN
+        batch.restart_games(finished)
+        batch.next_round(finished)
+    batch_rate = count * steps / (time.perf_counter() - start)
+
+    games = [Game(map_path) for _ in range(count)]
+    for game in games:
+        game.next_round()
+    moves = [(players.tolist(), directions.tolist()) for players, directions in moves]
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for players, directions in moves:
+            for game, player, direction in zip(games, players, directions):
+                game.apply_move(player, direction)
+                if game.state == State.WIN:
+                    game.restart_game()
+                    game.next_round()
+        loop_rate = count * steps / (time.perf_counter() - start)
+
+    return batch_rate, loop_rate
+
+
+def main():
+    count, steps, verify_steps, seed = ap().batch_sim_parse_arguments()
+    verify_win_on_ghost_cell()
+    verify(min(count, 256), verify_steps, seed)
+    print(f"BatchGame matched Game on {min(count, 256)} games for {verify_steps} steps")
+
+    batch_rate, loop_rate = benchmark(count, steps, seed)
+    print(f"BatchGame:      {batch_rate:>12.0f} game steps/s")
+    print(f"Game loop:      {loop_rate:>12.0f} game steps/s")
+    print(f"speedup: {batch_rate / loop_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
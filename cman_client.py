@@ -2,8 +2,8 @@ from arg_parser import ArgParser as ap
 from cman_client_impl import Client
 
 def main():
-    role, addr, port = ap().client_parse_arguments()
-    cman_client = Client(role, (addr, port))
+    role, addr, port, room, max_fps = ap().client_parse_arguments()
+    cman_client = Client(role, (addr, port), room, max_fps)
     cman_client.run()
 
 if __name__ == '__main__':
@@ -1,12 +1,17 @@
 from enum import Enum
 import socket
-import select
-from time import sleep
+import sys
+from time import monotonic
 from typing import List
-from cman_utils import get_pressed_keys, clear_print
+from cman_utils import cbreak_terminal, read_pressed_keys, clear_print
 from consts import *
-from cman_game import MAX_ATTEMPTS
+from cman_game import MAX_ATTEMPTS, Player
 from client_map import WorldMap
+from cman_protocol import DeltaDecoder
+from cman_prediction import MovePredictor
+from cman_renderer import TerminalRenderer
+from cman_event_loop import EventLoop
+from cman_reliable import ReliableChannel
 
 
 class Status(Enum):
@@ -21,16 +26,29 @@ class Role(Enum):
 
 class Client:
 
-    def __init__(self, role, server_address: tuple):
+    def __init__(self, role, server_address: tuple, room=None, max_fps=None):
         self.server_address = server_address
         self.role = Role(role)
+        self.room = room
         self.init_socket()
         self.status = Status.WAITING
         self.map = WorldMap(MAP_PATH)
         self.attempts = 0
         self.__msg = ''
+        self.__last_sent = 0.0
+        self.__renderer = TerminalRenderer(max_fps)
+        self.__render_timer = None
+        self.loop = EventLoop()
+        # JOIN and QUIT are acked by the server, and GAME_END is acked back to it.
+        self.__reliable = ReliableChannel(self.loop, self.__send_datagram, RELIABLE_MESSAGE, RELIABLE_ACK)
+        self.__quitting = False
+        self.__deltas = DeltaDecoder()
+        self.__predictor = None
+        if self.role != Role.SPECTATOR:
+            self.__predictor = MovePredictor(MAP_PATH, Player.CMAN if self.role == Role.CMAN else Player.SPIRIT)
 
     def close(self):
+        self.loop.close()
         self.socket.close()
 
     def exit(self, msg):
@@ -46,17 +64,27 @@ class Client:
 
     def run(self):
         print('Running client...')
-        get_pressed_keys()
-        self.join_game()
-        while self.status != Status.GAME_OVER:
-            self._process_user_input()
-            self._handle_server_input()
+        self.socket.setblocking(False)
+        # One wait over both stdin and the socket, so keys and server messages are handled as soon as they arrive.
+        with cbreak_terminal():
+            self.loop.add_reader(sys.stdin, self._process_user_input)
+            self.loop.add_reader(self.socket, self._handle_server_input)
+            self.join_game()
+            self._send_heartbeat_if_idle()
+            try:
+                self.loop.run_forever()
+            except KeyboardInterrupt:
+                self._quit_game()
+                self.loop.run_forever()
 
     def msg(self):
         return "Message: " + self.__msg if self.__msg else ''
 
     def join_game(self):
-        self.__send_msg(JOIN, self.role.value.to_bytes(1, 'big'))
+        join_data = self.role.value.to_bytes(1, 'big')
+        if self.room is not None:
+            join_data += self.room.to_bytes(2, 'big')
+        self.__reliable.send(bytes([JOIN]) + join_data, self.server_address)
         print(f'Requested to join as {self.role.name}')
 
     def _handle_server_input(self):
@@ -66,7 +94,16 @@ class Client:
         
         for data in datas:
             self.__handle_server_message(data)
-        clear_print('\n'.join([self.msg(), self.attempts_repr(), self.map.to_string()]))
+        self._render()
+
+    def _render(self):
+        # Called directly as well as from the timer, so a pending frame must not fire a second render later.
+        if self.__render_timer is not None:
+            self.__render_timer.cancel()
+            self.__render_timer = None
+        self.__renderer.render([self.msg(), self.attempts_repr()], self.map)
+        if self.__renderer.pending and self.__render_timer is None:
+            self.__render_timer = self.loop.call_later(self.__renderer.min_frame_interval, self._render)
 
     def attempts_repr(self):
         return f"Attempt: {self.attempts}/{MAX_ATTEMPTS}"
@@ -75,13 +112,11 @@ class Client:
         datas = []
         try:
             while True:
-                ready, _, _ = select.select([self.socket], [], [], 0)
-                if not ready:
-                    break
-                
                 raw, addr = self.socket.recvfrom(BUFFER_SIZE)
                 if addr == self.server_address:
                     datas.append(raw)
+        except BlockingIOError:
+            pass
         except socket.error as e:
             self.exit(f'Failed to receive data from server. Error: {e}\nExiting...')
         
@@ -91,10 +126,20 @@ class Client:
         op_code = data[0]
         if op_code == GAME_STATE_UPDATE:
             self.__update_map(data[1:])
+            # Acknowledging any state asks the server to switch this client to deltas.
+            self.__send_state_ack()
+        elif op_code == GAME_STATE_DELTA:
+            self.__update_map_from_delta(data)
         elif op_code == GAME_END:
             self.__handle_game_end(data[1:])
         elif op_code == ERROR:
             self.__handle_error(data[1:])
+        elif op_code == SERVER_RELIABLE_MESSAGE and len(data) > 3:
+            message = self.__reliable.receive(data, self.server_address)
+            if message is not None:
+                self.__handle_server_message(message)
+        elif op_code == SERVER_RELIABLE_ACK and len(data) == 3:
+            self.__reliable.acked(self.server_address, int.from_bytes(data[1:3], 'big'))
     
     def __update_map(self, data):
         freeze = data[0]
@@ -116,6 +161,22 @@ class Client:
         self.__update_points(collected)
         self.__place_cman_ghost(c_coords_b, s_coords_b)
 
+    def __update_map_from_delta(self, data):
+        decoded = self.__deltas.decode(data)
+        if decoded is not None:
+            freeze, input_ack, snapshot = decoded
+            if self.__predictor is not None:
+                snapshot = self.__predictor.reconcile(freeze, input_ack, snapshot)
+            self.__update_map(bytes([freeze]) + snapshot)
+        # Acks go out every few states, and at once on a gap so the server bases the next delta on a state we hold.
+        seq = self.__deltas.next_ack()
+        if seq is not None:
+            self.__send_msg(STATE_ACK, seq.to_bytes(2, 'big'))
+
+    def __send_state_ack(self):
+        last_seq = self.__deltas.last_seq
+        self.__send_msg(STATE_ACK, (last_seq if last_seq is not None else 0).to_bytes(2, 'big'))
+
     def __update_attempts(self, attempts):
         self.attempts = attempts + 1
 
@@ -160,29 +221,58 @@ class Client:
             self.exit('Exiting...')
     
     def _process_user_input(self):
-        keys: list = get_pressed_keys()
-        if not len(keys):
-            return
-        selected_key = keys[0].lower() # only process the first key, ignore the rest
+        # A single read can hold several keys, so each one is handled, up to a quit key.
+        for key in read_pressed_keys():
+            selected_key = key.lower()
+
+            if selected_key in ['^C', '^D', '\x03', '\x04', 'q']:
+                self._quit_game()
+                return
 
-        if selected_key in ['^C', '^D', 'q']:
-            self._quit_game()
+            if self.__quitting:
+                return
 
-        if self.role != Role.SPECTATOR and self.status == Status.PLAYING:
-            self.__send_movement(selected_key)
+            if self.role != Role.SPECTATOR and self.status == Status.PLAYING:
+                self.__send_movement(selected_key)
 
     def __send_msg(self, op_code: int, data: bytes):
+        self.__send_datagram(bytes([op_code]) + data, self.server_address)
+
+    def __send_datagram(self, message: bytes, address: tuple):
         try:
-            self.socket.sendto(bytes([op_code]) + data, self.server_address)
+            self.socket.sendto(message, address)
         except socket.error as e:
             self.exit('Failed to send message to server. Exiting...')
+        self.__last_sent = monotonic()
+
+    def _send_heartbeat_if_idle(self):
+        # Keeps a quiet client (a spectator, or a player waiting for its opponent) from being evicted.
+        if monotonic() - self.__last_sent >= HEARTBEAT_INTERVAL:
+            self.__send_msg(HEARTBEAT, b'')
+        self.loop.call_at(self.__last_sent + HEARTBEAT_INTERVAL, self._send_heartbeat_if_idle)
 
     def __send_movement(self, selected_key):
         if selected_key not in DIRECTION_TO_BYTE:
             print(f'Invalid key: {selected_key} Please use the WASD keys to move, Q to exit.')
+            self.__renderer.invalidate()
+            return
+        direction = DIRECTION_TO_BYTE[selected_key]
+        if self.__deltas.last_seq is None:
+            # Input acks only come with deltas, so there is nothing to reconcile predictions against yet.
+            self.__send_msg(PLAYER_MOVEMENT, direction.to_bytes(1, 'big'))
             return
-        self.__send_msg(PLAYER_MOVEMENT, DIRECTION_TO_BYTE[selected_key].to_bytes(1, 'big'))
+
+        input_seq = self.__predictor.next_input_seq(direction)
+        self.__send_msg(PLAYER_MOVEMENT, bytes([direction, input_seq]))
+        self.__update_map(bytes([0x00]) + self.__predictor.predicted_snapshot())
+        self._render()
 
     def _quit_game(self):
-        self.__send_msg(QUIT, b'')
-        self.exit('Quitting game...')
\ No newline at end of file
+        if self.__quitting:
+            return
+        self.__quitting = True
+        # Waiting for the ack means a lost QUIT cannot leave our slot taken on the server.
+        self.__reliable.send(bytes([QUIT]), self.server_address, on_done=self.__quit_done)
+
+    def __quit_done(self, delivered):
+        self.exit('Quitting game...' if delivered else 'The server did not answer. Quitting game...')
\ No newline at end of file
@@ -0,0 +1,20 @@
+import os
+
+from arg_parser import ArgParser as ap
+from cman_map_cache import cache_path, compile_map, hash_source, read_cache, write_cache
+
+
+def main():
+    map_paths, force = ap().map_cache_parse_arguments()
+    for map_path in map_paths:
+        path = cache_path(map_path)
+        source_hash = hash_source(map_path)
+        if not force and read_cache(path, source_hash) is not None:
+            print(f"{path} is up to date")
+            continue
+        write_cache(compile_map(map_path, source_hash), path)
+        print(f"Compiled {map_path} into {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
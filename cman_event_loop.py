@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import selectors
+import signal
+import socket
+import time
+
+
+class TimerHandle:
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+
+    A minimal event loop over selectors (epoll on Linux) with a timer queue.
+
+    The method names follow asyncio's loop API, so code that only schedules timers
+    and registers readers can run on either loop.
+
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._running = False
+        self._signal_handlers = {}
+        self._signal_sock = None
+        self._signal_wakeup = None
+
+    def time(self):
+        return time.monotonic()
+
+    def add_reader(self, fileobj, callback, *args):
+        self.selector.register(fileobj, selectors.EVENT_READ, (callback, args))
+
+    def remove_reader(self, fileobj):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def call_at(self, when, callback, *args):
+        handle = TimerHandle(when, callback, args)
+        heapq.heappush(self._timers, (when, next(self._timer_ids), handle))
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def add_signal_handler(self, sig, callback, *args):
+        if self._signal_sock is None:
+            self._signal_sock, self._signal_wakeup = socket.socketpair()
+            self._signal_sock.setblocking(False)
+            self._signal_wakeup.setblocking(False)
+            signal.set_wakeup_fd(self._signal_wakeup.fileno())
+            self.add_reader(self._signal_sock, self._read_signals)
+        self._signal_handlers[sig] = (callback, args)
+        # The handler itself does nothing: the signal number reaches the loop through the wakeup fd.
+        signal.signal(sig, lambda signum, frame: None)
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        if self._signal_sock is not None:
+            signal.set_wakeup_fd(-1)
+            self.remove_reader(self._signal_sock)
+            self._signal_sock.close()
+            self._signal_wakeup.close()
+            self._signal_sock = None
+        self.selector.close()
+
+    def run_forever(self):
+        self._running = True
+        while self._running:
+            self._run_once()
+
+    def _run_once(self):
+        events = self.selector.select(self._next_timeout())
+        for key, _ in events:
+            callback, args = key.data
+            callback(*args)
+
+        now = self.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, handle = heapq.heappop(self._timers)
+            if not handle.cancelled:
+                handle.callback(*handle.args)
+
+    def _read_signals(self):
+        try:
+            signums = self._signal_sock.recv(64)
+        except BlockingIOError:
+            return
+        for signum in signums:
+            handler = self._signal_handlers.get(signum)
+            if handler is not None:
+                callback, args = handler
+                callback(*args)
+
+    def _next_timeout(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - self.time())
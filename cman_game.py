@@ -1,5 +1,5 @@
-import cman_game_map as gm
 import os
+from cman_map_cache import load_compiled_map
 from enum import IntEnum
 
 MAX_ATTEMPTS = 3
@@ -23,6 +23,9 @@ class State(IntEnum):
 	WIN = 3		# Game ended
 
 class Game():
+	__slots__ = ('board', 'board_dims', 'compiled_board', 'start_coords', 'start_cells', 'cur_cells', 'points',
+				 'points_bytes_len', 'point_bits', 'version', 'score', 'collected_points', 'lives', 'state', 'winner')
+
 	def __init__(self, map_path):
 		"""
 
@@ -34,17 +37,20 @@ class Game():
 
 		"""
 		assert os.path.isfile(map_path), "map file does not exist."
-		self.board = gm.read_map(map_path).split('\n')
+		compiled_map = load_compiled_map(map_path)
+		self.board = compiled_map.lines
 		self.board_dims = (len(self.board), len(self.board[0]))
+		self.compiled_board = compiled_map.board
 
-		self.start_coords = []
-		for p_char in gm.PLAYER_CHARS:
-			start_row = [p_char in row for row in self.board].index(True)
-			self.start_coords.append((start_row, self.board[start_row].index(p_char)))
+		self.start_cells = list(compiled_map.start_cells)
+		self.start_coords = [self.compiled_board.coords_of(cell) for cell in self.start_cells]
 
-		self.points = {(i,j):1 for i in range(self.board_dims[0])
-							   for j in range(self.board_dims[1])
-							   if self.board[i][j] == gm.POINT_CHAR}
+		self.points = {self.compiled_board.coords_of(cell):1 for cell in compiled_map.point_cells}
+		# Points in wire order, sorted by (row, col), the first one on the most significant bit.
+		self.points_bytes_len = self.compiled_board.points_bytes_len
+		self.point_bits = {coord: self.compiled_board.point_bits[self.compiled_board.cell_of(coord)] for coord in self.points}
+		# Bumped on every change to the state sent to clients, so encoders can skip unchanged states.
+		self.version = 0
 		self.restart_game()
 
 	def restart_game(self):
@@ -53,10 +59,12 @@ class Game():
 		Restarts all the variables of this game instance to their initial values.
 
 		"""
-		self.cur_coords = self.start_coords[::]
+		self.cur_cells = self.start_cells[::]
 		self.score = 0
 		for p in self.points.keys():
 			self.points[p] = 1
+		self.collected_points = 0
+		self.version += 1
 		self.lives = MAX_ATTEMPTS
 		self.state = State.WAIT
 		self.winner = None
@@ -67,8 +75,23 @@ class Game():
 		Moves all player coordinates to their starting coordinates and enable legal moves to be processed.
 
 		"""
-		self.cur_coords = self.start_coords[::]
+		self.cur_cells = self.start_cells[::]
 		self.state = State.START
+		self.version += 1
+
+	@property
+	def cur_coords(self):
+		"""
+
+		list(tuple(int, int)): The current coordinates of each player. Players are tracked as compiled board cells,
+		so the list is rebuilt on every read and only assigning a whole new list changes it.
+
+		"""
+		return [self.compiled_board.coords_of(cell) for cell in self.cur_cells]
+
+	@cur_coords.setter
+	def cur_coords(self, coords):
+		self.cur_cells = [self.compiled_board.cell_of(c) for c in coords]
 
 	def get_current_players_coords(self):
 		"""
@@ -102,6 +125,16 @@ class Game():
 		"""
 		return self.points
 
+	def get_collected_points_bytes(self):
+		"""
+		
+		Returns:
+
+		bytes: The collected points as a big-endian bitmask, one bit per point ordered by (row, col), set if collected
+
+		"""
+		return self.collected_points.to_bytes(self.points_bytes_len, 'big')
+
 	def get_winner(self):
 		"""
 		
@@ -166,32 +199,32 @@ class Game():
 		bool: Whether the game state was changed or not
 
 		"""
-		if not self.can_move(player):
+		if not (self.state == State.PLAY or (self.state == State.START and player == Player.CMAN)):
 			return False
 
-		p_coords = self.cur_coords[player]
-		dr = -1 if direction == Direction.UP else 1 if direction == Direction.DOWN else 0
-		dc = -1 if direction == Direction.LEFT else 1 if direction == Direction.RIGHT else 0
-		next_coords = (p_coords[0] + dr, p_coords[1] + dc)
-
-		if any(x < 0 for x in next_coords) or next_coords[0] >= self.board_dims[0] or next_coords[1] >= self.board_dims[1]:
-			return False
-		if self.board[next_coords[0]][next_coords[1]] not in gm.PASS_CHARS:
+		board = self.compiled_board
+		cur_cells = self.cur_cells
+		next_cell = board.neighbours[cur_cells[player] * 4 + direction]
+		if next_cell < 0:
 			return False
-		else:
-			self.state = State.PLAY
-			self.cur_coords[player] = next_coords
-			if player == Player.CMAN and next_coords in self.points.keys():
-				self.score += self.points[next_coords]
-				self.points[next_coords] = 0
+
+		self.state = State.PLAY
+		cur_cells[player] = next_cell
+		self.version += 1
+		if player == Player.CMAN:
+			bit = board.point_bits[next_cell]
+			if bit and not self.collected_points & bit:
+				self.score += 1
+				self.points[board.coords_of(next_cell)] = 0
+				self.collected_points |= bit
 				if self.score >= WIN_SCORE:
 					print("Cman won")
 					self.declare_winner(Player.CMAN)
-			if (player == Player.CMAN and next_coords in self.cur_coords[1:]) or (player != Player.CMAN and next_coords == self.cur_coords[0]):
-				self.lives -= 1
-				if self.lives <= 0:
-					print("Spirit won")
-					self.declare_winner(Player.SPIRIT)
-				else:
-					self.next_round()
-			return True
+		if cur_cells[0] == cur_cells[1]:
+			self.lives -= 1
+			if self.lives <= 0:
+				print("Spirit won")
+				self.declare_winner(Player.SPIRIT)
+			else:
+				self.next_round()
+		return True
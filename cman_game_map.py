@@ -6,6 +6,8 @@ FREE_CHAR = 'F'
 PASS_CHARS = [CMAN_CHAR, SPIRIT_CHAR, POINT_CHAR, FREE_CHAR]
 WALL_CHAR = 'W'
 MAX_POINTS = 40
+# Row and column steps indexed by cman_game.Direction (UP, LEFT, DOWN, RIGHT).
+DIRECTION_DELTAS = [(-1, 0), (0, -1), (1, 0), (0, 1)]
 
 def read_map(path):
     """
@@ -36,4 +38,61 @@ def read_map(path):
         bbc = map_lines[0] == WALL_CHAR*len(map_lines[0]) and map_lines[-1] == WALL_CHAR*len(map_lines[-1])
         assert sbc and tbc and bbc, "map border is open."
 
-        return map_data
\ No newline at end of file
+        return map_data
+
+class Board:
+    """
+
+    A map compiled for moves that only take integer lookups.
+
+    Cells are numbered row * cols + col. neighbours[cell * 4 + direction] is the cell a move leads to,
+    or -1 if it is blocked, and point_bits[cell] is the cell's bit in the collected points bitmask
+    (points ordered by (row, col), the first one on the most significant bit), or 0 for cells without a point.
+
+    """
+
+    __slots__ = ('rows', 'cols', 'neighbours', 'point_bits', 'points_bytes_len')
+
+    def __init__(self, map_lines):
+        self.rows = len(map_lines)
+        self.cols = len(map_lines[0])
+        chars = ''.join(map_lines)
+
+        self.neighbours = [-1] * (len(chars) * len(DIRECTION_DELTAS))
+        for cell, char in enumerate(chars):
+            if char not in PASS_CHARS:
+                continue
+            row, col = divmod(cell, self.cols)
+            for direction, (dr, dc) in enumerate(DIRECTION_DELTAS):
+                next_row, next_col = row + dr, col + dc
+                if 0 <= next_row < self.rows and 0 <= next_col < self.cols:
+                    next_cell = next_row * self.cols + next_col
+                    if chars[next_cell] in PASS_CHARS:
+                        self.neighbours[cell * len(DIRECTION_DELTAS) + direction] = next_cell
+
+        point_cells = [cell for cell, char in enumerate(chars) if char == POINT_CHAR]
+        self.points_bytes_len = (len(point_cells) + 7) // 8
+        self.point_bits = [0] * len(chars)
+        for i, cell in enumerate(point_cells):
+            self.point_bits[cell] = 1 << (8*self.points_bytes_len - 1 - i)
+
+    @classmethod
+    def from_tables(cls, rows, cols, neighbours, point_bits, points_bytes_len):
+        """
+
+        Builds a Board around tables compiled earlier, such as the memory-mapped ones of a map cache.
+
+        """
+        board = cls.__new__(cls)
+        board.rows = rows
+        board.cols = cols
+        board.neighbours = neighbours
+        board.point_bits = point_bits
+        board.points_bytes_len = points_bytes_len
+        return board
+
+    def cell_of(self, coords):
+        return coords[0] * self.cols + coords[1]
+
+    def coords_of(self, cell):
+        return divmod(cell, self.cols)
@@ -0,0 +1,96 @@
+import random
+
+from consts import MAP_PATH
+from cman_game import Player
+from cman_game_map import DIRECTION_DELTAS
+from cman_map_cache import load_compiled_map
+
+# Marks a pair of cells with no path between them, or a cell paired with itself.
+NO_STEP = 0xFF
+# The index of a cell no move leads out of, which the table leaves out.
+NO_INDEX = -1
+DEFAULT_GHOST_BOT_HZ = 4.0
+# How long a cman waits for a ghost client before the bot takes the ghost's place, in seconds.
+GHOST_BOT_JOIN_DELAY = 5.0
+
+_OPPOSITE = [DIRECTION_DELTAS.index((-dr, -dc)) for dr, dc in DIRECTION_DELTAS]
+
+# Tables already built by this process, by map source hash.
+_tables = {}
+
+
+class NextStepTable:
+    """
+
+    For every pair of open cells of a compiled board (cells with a move out of them), the direction of the
+    first step of a shortest path from one to the other, found by a BFS from every open cell. Walls are left
+    out through a cell -> index map, so the table is open cells squared, and looking a step up is two
+    indexes into lists and one into a bytearray.
+
+    """
+
+    __slots__ = ('board', 'index', 'count', 'steps')
+
+    def __init__(self, board):
+        self.board = board
+        neighbours = board.neighbours
+        directions = len(DIRECTION_DELTAS)
+        open_cells = [cell for cell in range(board.rows * board.cols)
+                      if any(neighbours[cell * directions + direction] >= 0 for direction in range(directions))]
+        self.index = [NO_INDEX] * (board.rows * board.cols)
+        for i, cell in enumerate(open_cells):
+            self.index[cell] = i
+        self.count = len(open_cells)
+        self.steps = bytearray([NO_STEP]) * (self.count * self.count)
+        for target in open_cells:
+            # Walking the BFS outwards from the target, the step from a new cell is back towards the cell it was reached from.
+            row = self.index[target] * self.count
+            queue = [target]
+            for cell in queue:
+                for direction in range(directions):
+                    next_cell = neighbours[cell * directions + direction]
+                    if next_cell >= 0 and next_cell != target and self.steps[row + self.index[next_cell]] == NO_STEP:
+                        self.steps[row + self.index[next_cell]] = _OPPOSITE[direction]
+                        queue.append(next_cell)
+
+    def step(self, source, target):
+        """Returns the direction of the first step from source towards target, or NO_STEP."""
+        source_index, target_index = self.index[source], self.index[target]
+        if source_index == NO_INDEX or target_index == NO_INDEX:
+            return NO_STEP
+        return self.steps[target_index * self.count + source_index]
+
+    def open_directions(self, cell):
+        return [direction for direction in range(len(DIRECTION_DELTAS)) if self.board.neighbours[cell * 4 + direction] >= 0]
+
+
+def next_step_table(map_path=MAP_PATH):
+    compiled_map = load_compiled_map(map_path)
+    table = _tables.get(compiled_map.source_hash)
+    if table is None:
+        table = _tables[compiled_map.source_hash] = NextStepTable(compiled_map.board)
+    return table
+
+
+class GhostBot:
+    """
+
+    Picks the moves of a server-side ghost. With probability difficulty a move follows a shortest path to
+    the cman, otherwise it goes in a random open direction, so 1.0 always chases and 0.0 wanders. A ghost
+    with no way out gets None.
+
+    """
+
+    def __init__(self, table, difficulty, rng=None):
+        self.table = table
+        self.difficulty = difficulty
+        self.rng = rng or random.Random()
+
+    def next_direction(self, game):
+        cman_cell, ghost_cell = game.cur_cells[Player.CMAN], game.cur_cells[Player.SPIRIT]
+        if self.rng.random() < self.difficulty:
+            direction = self.table.step(ghost_cell, cman_cell)
+            if direction != NO_STEP:
+                return direction
+        directions = self.table.open_directions(ghost_cell)
+        return self.rng.choice(directions) if directions else None
@@ -0,0 +1,256 @@
+import random
+import resource
+import socket
+
+from arg_parser import ArgParser as ap
+from consts import BUFFER_SIZE, JOIN, PLAYER_MOVEMENT, STATE_ACK, RELIABLE_MESSAGE, RELIABLE_ACK, QUIT, GAME_STATE_UPDATE, \
+    GAME_STATE_DELTA, SERVER_RELIABLE_MESSAGE, GAME_END, ERROR
+from cman_event_loop import EventLoop
+from cman_reliable import ReliableChannel
+from cman_protocol import DeltaDecoder, DELTA_INPUT_ACK_OFFSET, INPUT_SEQ_MODULO, seq_newer
+
+# A move whose echo has not come back after this long is counted as lost.
+MOVE_TIMEOUT = 1.0
+# JOIN is repeated this often until the server answers with a state.
+JOIN_RETRY_INTERVAL = 0.5
+
+
+class LoadClient:
+    """
+
+    One simulated cman, ghost or spectator. It speaks the same protocol as cman_client_impl.Client: JOIN,
+    STATE_ACKs, numbered PLAYER_MOVEMENTs and QUIT. Unlike Client it repeats a JOIN that
+    got no answer, since a burst of joins can overflow the server's socket buffer.
+
+    A move's latency is the time until a GAME_STATE_DELTA first echoes its input sequence number, which is
+    the first state the server sent after handling it.
+
+    """
+
+    def __init__(self, generator, role, room_id):
+        self.generator = generator
+        self.role = role
+        self.room_id = room_id
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect(generator.server_address)
+        self.socket.setblocking(False)
+        self.deltas = DeltaDecoder()
+        # Only used to ack the server's GAME_END; JOIN has its own retry and QUIT is fire-and-forget here.
+        self.reliable = ReliableChannel(generator.loop, lambda message, _: self.send(message), RELIABLE_MESSAGE, RELIABLE_ACK)
+        self.joined = False
+        self.join_timer = None
+        self.input_seq = 0
+        # Input sequence number -> send time of the moves not echoed yet.
+        self.pending_moves = {}
+
+    def join(self):
+        self.joined = False
+        self.deltas = DeltaDecoder()
+        self.send(bytes([JOIN, self.role]) + self.room_id.to_bytes(2, 'big'))
+        if self.join_timer is not None:
+            self.join_timer.cancel()
+        self.join_timer = self.generator.loop.call_later(JOIN_RETRY_INTERVAL, self.join)
+
+    def on_joined(self):
+        if not self.joined:
+            self.joined = True
+            self.join_timer.cancel()
+            self.join_timer = None
+
+    def quit(self):
+        self.send(bytes([QUIT]))
+
+    def move(self):
+        if not self.joined:
+            return
+        self.input_seq = (self.input_seq + 1) % INPUT_SEQ_MODULO
+        self.pending_moves[self.input_seq] = self.generator.loop.time()
+        self.generator.moves_sent += 1
+        self.send(bytes([PLAYER_MOVEMENT, random.randrange(4), self.input_seq]))
+
+    def send(self, message):
+        try:
+            self.socket.send(message)
+        except BlockingIOError:
+            self.generator.send_failures += 1
+
+    def on_readable(self):
+        while True:
+            try:
+                data = self.socket.recv(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except socket.error:
+                self.generator.receive_errors += 1
+                return
+            if data:
+                self.generator.updates_received += 1
+                self.handle_message(data)
+
+    def handle_message(self, data):
+        op_code = data[0]
+        if op_code == GAME_STATE_UPDATE:
+            self.on_joined()
+            self.ack()
+        elif op_code == GAME_STATE_DELTA:
+            self.on_joined()
+            self.deltas.decode(data)
+            seq = self.deltas.next_ack()
+            if seq is not None:
+                self.send(bytes([STATE_ACK]) + seq.to_bytes(2, 'big'))
+            self.echoed(data[DELTA_INPUT_ACK_OFFSET])
+        elif op_code == SERVER_RELIABLE_MESSAGE and len(data) > 3:
+            message = self.reliable.receive(data, self.generator.server_address)
+            if message is not None:
+                self.handle_message(message)
+        elif op_code == GAME_END:
+            # The room was reset, so join its next match. Once joined, the server stops repeating GAME_END to us.
+            if self.role == 0x01:
+                self.generator.games_ended += 1
+            self.join()
+        elif op_code == ERROR:
+            # Errors do not say which move they answer; assume the latest one, as moves are rejected on arrival.
+            self.generator.errors_received += 1
+            if self.pending_moves:
+                del self.pending_moves[max(self.pending_moves, key=self.pending_moves.get)]
+                self.generator.moves_rejected += 1
+
+    def ack(self):
+        last_seq = self.deltas.last_seq
+        self.send(bytes([STATE_ACK]) + (last_seq if last_seq is not None else 0).to_bytes(2, 'big'))
+
+    def echoed(self, input_ack):
+        sent = self.pending_moves.pop(input_ack, None)
+        if sent is None:
+            return
+        now = self.generator.loop.time()
+        self.generator.latencies.append(now - sent)
+        # The server echoes the latest move it handled, so older moves still waiting were lost on the way.
+        for seq in [seq for seq in self.pending_moves if seq_newer(input_ack, seq, INPUT_SEQ_MODULO)]:
+            del self.pending_moves[seq]
+            self.generator.moves_lost += 1
+
+    def expire_moves(self, now):
+        for seq, sent in list(self.pending_moves.items()):
+            if now - sent > MOVE_TIMEOUT:
+                del self.pending_moves[seq]
+                self.generator.moves_lost += 1
+
+
+class LoadGenerator:
+    """
+
+    Runs a cman, a ghost and some spectators in each of several rooms against a server, from one process.
+
+    Every player moves in a random direction move_hz times a second. Throughput, loss and latency
+    percentiles are reported when the run ends.
+
+    """
+
+    def __init__(self, server_address, rooms, spectators, move_hz, duration, first_room=0):
+        self.server_address = server_address
+        self.duration = duration
+        self.move_interval = 1.0 / move_hz
+        self.loop = EventLoop()
+        self.clients = []
+        self.players = []
+        self.latencies = []
+        self.moves_sent = 0
+        self.moves_lost = 0
+        self.moves_rejected = 0
+        self.errors_received = 0
+        self.updates_received = 0
+        self.games_ended = 0
+        self.send_failures = 0
+        self.receive_errors = 0
+
+        for room_id in range(first_room, first_room + rooms):
+            for _ in range(spectators):
+                self.clients.append(LoadClient(self, 0x00, room_id))
+            for role in (0x01, 0x02):
+                player = LoadClient(self, role, room_id)
+                self.clients.append(player)
+                self.players.append(player)
+
+    def run(self):
+        for client in self.clients:
+            self.loop.add_reader(client.socket, client.on_readable)
+            client.join()
+        # Spread the players' moves over the interval instead of sending them all at once.
+        for player in self.players:
+            self.loop.call_later(random.random() * self.move_interval, self._move, player)
+        self.loop.call_later(MOVE_TIMEOUT, self._expire_moves)
+        self.loop.call_later(self.duration, self.loop.stop)
+
+        start = self.loop.time()
+        try:
+            self.loop.run_forever()
+        finally:
+            elapsed = self.loop.time() - start
+            for client in self.clients:
+                client.quit()
+                client.socket.close()
+            self.loop.close()
+        return self.report(elapsed)
+
+    def _move(self, player):
+        self.loop.call_later(self.move_interval, self._move, player)
+        player.move()
+
+    def _expire_moves(self):
+        self.loop.call_later(MOVE_TIMEOUT, self._expire_moves)
+        now = self.loop.time()
+        for player in self.players:
+            player.expire_moves(now)
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        answered = len(latencies)
+        return {
+            'clients': len(self.clients),
+            'seconds': elapsed,
+            'moves_sent': self.moves_sent,
+            'moves_per_sec': self.moves_sent / elapsed,
+            'updates_per_sec': self.updates_received / elapsed,
+            'loss': self.moves_lost / (answered + self.moves_lost) if answered + self.moves_lost else 0.0,
+            'moves_rejected': self.moves_rejected,
+            'errors_received': self.errors_received,
+            'games_ended': self.games_ended,
+            'send_failures': self.send_failures,
+            'p50_ms': _percentile(latencies, 0.50) * 1e3,
+            'p99_ms': _percentile(latencies, 0.99) * 1e3,
+            'p999_ms': _percentile(latencies, 0.999) * 1e3,
+        }
+
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+
+def _raise_open_files_limit():
+    # Every simulated client has its own socket.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    addr, port, rooms, spectators, move_hz, duration, first_room = ap().loadgen_parse_arguments()
+    _raise_open_files_limit()
+    generator = LoadGenerator((addr, port), rooms, spectators, move_hz, duration, first_room)
+    print(f"Running {len(generator.clients)} clients in {rooms} rooms against {addr}:{port} for {duration}s...")
+    result = generator.run()
+
+    print(f"Moves sent:      {result['moves_sent']} ({result['moves_per_sec']:.0f}/s)")
+    print(f"Updates:         {result['updates_per_sec']:.0f}/s received")
+    print(f"Move loss:       {result['loss'] * 100:.2f}%")
+    print(f"Moves rejected:  {result['moves_rejected']} ({result['errors_received']} errors received)")
+    print(f"Games ended:     {result['games_ended']}")
+    print(f"Send failures:   {result['send_failures']}")
+    print(f"Move latency:    p50 {result['p50_ms']:.2f}ms  p99 {result['p99_ms']:.2f}ms  p999 {result['p999_ms']:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import cman_game_map as gm
+from consts import MAP_PATH
+
+MAGIC = b'CMAP'
+FORMAT_VERSION = 1
+# magic, format version, byte order of the tables, sha256 of the map source, rows, cols, cman cell, spirit cell,
+# points bytes length.
+HEADER_FORMAT = '>4sBB32sBBIIB'
+HEADER_LEN = struct.calcsize(HEADER_FORMAT)
+# The tables are stored in native byte order so they can be used straight from the mapping.
+NEIGHBOUR_TYPE = 'i'
+POINT_BIT_TYPE = 'q'
+TABLE_ALIGNMENT = 8
+
+# Maps already loaded by this process, by path.
+_loaded = {}
+
+
+class CompiledMap:
+    """
+
+    A validated map and its compiled Board, loaded from a .cmap cache file next to the map source.
+
+    The cache is keyed by the sha256 of the source, so an edited map is recompiled on its next load. The
+    board tables are memory-mapped read-only, so processes loading the same cache share their pages.
+
+    """
+
+    __slots__ = ('lines', 'board', 'start_cells', 'point_cells', 'source_hash')
+
+    def __init__(self, lines, board, start_cells, source_hash):
+        self.lines = lines
+        self.board = board
+        self.start_cells = start_cells
+        self.point_cells = tuple(cell for cell, bit in enumerate(board.point_bits) if bit)
+        self.source_hash = source_hash
+
+
+def cache_path(map_path):
+    return os.path.splitext(map_path)[0] + '.cmap'
+
+
+def hash_source(map_path):
+    with open(map_path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def load_compiled_map(map_path=MAP_PATH):
+    """
+
+    Returns the CompiledMap of map_path, from this process's memory, the cache file or by compiling the source.
+
+    A missing, stale or unreadable cache is rewritten; if it cannot be written the compiled map is only kept in memory.
+
+    """
+    source_hash = hash_source(map_path)
+    compiled = _loaded.get(map_path)
+    if compiled is not None and compiled.source_hash == source_hash:
+        return compiled
+
+    compiled = read_cache(cache_path(map_path), source_hash)
+    if compiled is None:
+        compiled = compile_map(map_path, source_hash)
+        try:
+            write_cache(compiled, cache_path(map_path))
+        except OSError as e:
+            print(f'Failed to write map cache {cache_path(map_path)}. Error: {e}')
+        else:
+            # Reload through the mapping, so this process shares the tables like later ones will.
+            compiled = read_cache(cache_path(map_path), source_hash) or compiled
+
+    _loaded[map_path] = compiled
+    return compiled
+
+
+def write_cache(compiled, path):
+    board = compiled.board
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, sys.byteorder == 'big', compiled.source_hash,
+                         board.rows, board.cols, compiled.start_cells[0], compiled.start_cells[1], board.points_bytes_len)
+    chars = ''.join(compiled.lines).encode('ascii')
+    data = bytearray(header + chars)
+    for table in (_as_table(board.neighbours, NEIGHBOUR_TYPE), _as_table(board.point_bits, POINT_BIT_TYPE)):
+        data += bytes(-len(data) % TABLE_ALIGNMENT)
+        data += table.tobytes()
+
+    # Written aside and renamed, so a process loading concurrently never maps a half-written file.
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _as_table(values, type_code):
+    table = memoryview(bytearray(len(values) * struct.calcsize(type_code))).cast(type_code)
+    for i, value in enumerate(values):
+        table[i] = value
+    return table
+
+
+def compile_map(map_path, source_hash):
+    lines = gm.read_map(map_path).split('\n')
+    board = gm.Board(lines)
+    start_cells = []
+    for p_char in gm.PLAYER_CHARS:
+        start_row = [p_char in row for row in lines].index(True)
+        start_cells.append(board.cell_of((start_row, lines[start_row].index(p_char))))
+    return CompiledMap(lines, board, tuple(start_cells), source_hash)
+
+
+def read_cache(path, source_hash):
+    try:
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mapping) < HEADER_LEN:
+        mapping.close()
+        return None
+    magic, version, big_endian, cached_hash, rows, cols, cman_cell, spirit_cell, points_bytes_len = \
+        struct.unpack_from(HEADER_FORMAT, mapping)
+    if magic != MAGIC or version != FORMAT_VERSION or big_endian != (sys.byteorder == 'big') or cached_hash != source_hash:
+        mapping.close()
+        return None
+
+    cells = rows * cols
+    offset = HEADER_LEN + cells
+    layout = []
+    for type_code, count in ((NEIGHBOUR_TYPE, cells * len(gm.DIRECTION_DELTAS)), (POINT_BIT_TYPE, cells)):
+        offset += -offset % TABLE_ALIGNMENT
+        size = count * struct.calcsize(type_code)
+        layout.append((type_code, offset, size))
+        offset += size
+    # Everything is checked before the tables are viewed, since a mapping with views into it cannot be closed.
+    if offset > len(mapping):
+        mapping.close()
+        return None
+    try:
+        chars = mapping[HEADER_LEN:HEADER_LEN + cells].decode('ascii')
+    except UnicodeDecodeError:
+        mapping.close()
+        return None
+    tables = [memoryview(mapping)[start:start + size].cast(type_code) for type_code, start, size in layout]
+
+    lines = [chars[row * cols:(row + 1) * cols] for row in range(rows)]
+    board = gm.Board.from_tables(rows, cols, tables[0], tables[1], points_bytes_len)
+    return CompiledMap(lines, board, (cman_cell, spirit_cell), source_hash)
+
@@ -0,0 +1,166 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+from collections import Counter
+
+from consts import ERROR_DICT, JOIN, PLAYER_MOVEMENT, STATE_ACK, HEARTBEAT, STATS, RELIABLE_MESSAGE, RELIABLE_ACK, QUIT, \
+    GAME_STATE_UPDATE, GAME_STATE_DELTA, STATS_REPLY, SERVER_RELIABLE_MESSAGE, SERVER_RELIABLE_ACK, GAME_END, ERROR
+
+OPCODE_NAMES = {
+    JOIN: 'JOIN',
+    PLAYER_MOVEMENT: 'PLAYER_MOVEMENT',
+    STATE_ACK: 'STATE_ACK',
+    HEARTBEAT: 'HEARTBEAT',
+    STATS: 'STATS',
+    RELIABLE_MESSAGE: 'RELIABLE_MESSAGE',
+    RELIABLE_ACK: 'RELIABLE_ACK',
+    QUIT: 'QUIT',
+    GAME_STATE_UPDATE: 'GAME_STATE_UPDATE',
+    GAME_STATE_DELTA: 'GAME_STATE_DELTA',
+    STATS_REPLY: 'STATS_REPLY',
+    SERVER_RELIABLE_MESSAGE: 'SERVER_RELIABLE_MESSAGE',
+    SERVER_RELIABLE_ACK: 'SERVER_RELIABLE_ACK',
+    GAME_END: 'GAME_END',
+    ERROR: 'ERROR',
+}
+DEFAULT_METRICS_INTERVAL = 10.0
+# How many functions a finished profile prints.
+PROFILE_PRINT_LIMIT = 20
+
+
+class Histogram:
+    """
+
+    Counts values in power-of-two buckets: bucket b holds the values in [2 ** (b - 1), 2 ** b).
+
+    """
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.buckets[int(value).bit_length()] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the given fraction of the values."""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return 1 << bucket
+        return 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+            'buckets': {f'<{1 << bucket}': count for bucket, count in sorted(self.buckets.items())},
+        }
+
+
+class ServerMetrics:
+    """
+
+    Counters a CManServer keeps about its traffic: packets and bytes per opcode in each direction, errors
+    sent by code, the time from receiving a datagram to the end of the broadcast it triggered (in
+    microseconds), fan-out sizes and batch sizes.
+
+    With --tick-hz, broadcasts happen on ticks, so the processing time stops when the datagram's batch is
+    handled instead.
+
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.packets_in = Counter()
+        self.bytes_in = Counter()
+        self.packets_out = Counter()
+        self.bytes_out = Counter()
+        self.forwarded_in = 0
+        self.errors = Counter()
+        self.processing_us = Histogram()
+        self.fanout = Counter()
+        self.batch_sizes = Counter()
+        # Moves dropped by reason: 'rate_limited' by the token bucket, 'queue_full' by the move queue.
+        self.moves_dropped = Counter()
+        self.received_at = []
+        self.profiler = None
+
+    def received(self, data, forwarded=False):
+        # A datagram relayed by another worker was already counted by the worker that received it.
+        if forwarded:
+            self.forwarded_in += 1
+        else:
+            opcode = data[0] if data else None
+            self.packets_in[opcode] += 1
+            self.bytes_in[opcode] += len(data)
+        self.received_at.append(time.perf_counter())
+
+    def handled(self):
+        """Records the processing time of every datagram received since the last call."""
+        now = time.perf_counter()
+        for received_at in self.received_at:
+            self.processing_us.add((now - received_at) * 1e6)
+        self.received_at.clear()
+
+    def sent(self, message):
+        self.packets_out[message[0]] += 1
+        self.bytes_out[message[0]] += len(message)
+
+    def snapshot(self, server):
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'pid': os.getpid(),
+            'rooms': len(server.rooms),
+            'sessions': len(server.sessions),
+            'packets_in': _by_opcode(self.packets_in),
+            'bytes_in': _by_opcode(self.bytes_in),
+            'packets_out': _by_opcode(self.packets_out),
+            'bytes_out': _by_opcode(self.bytes_out),
+            'forwarded_in': self.forwarded_in,
+            'errors': {str(code): {'message': ERROR_DICT[code], 'count': count}
+                       for code, count in sorted(self.errors.items())},
+            'processing_us': self.processing_us.snapshot(),
+            'fanout': dict(sorted(self.fanout.items())),
+            'batches': server.get_batch_stats(),
+            'reliable': server.reliable.get_stats(),
+            'moves_dropped': dict(self.moves_dropped),
+            'moves_queued': sum(len(session.moves) for session in server.queued_sessions),
+            'profiling': self.profiler is not None,
+        }
+
+    def write(self, server, path):
+        # Written aside and renamed, so readers never see a half-written file.
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(server), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def toggle_profiler(self):
+        """Starts a cProfile capture, or stops the running one, writes it to a .prof file and prints its top functions."""
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            print("Profiling started")
+            return
+
+        self.profiler.disable()
+        path = f'cman_server.{os.getpid()}.{int(time.time())}.prof'
+        self.profiler.dump_stats(path)
+        pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(PROFILE_PRINT_LIMIT)
+        self.profiler = None
+        print(f"Profile written to {path}")
+
+
+def _by_opcode(counter):
+    return {OPCODE_NAMES.get(opcode, str(opcode)): count for opcode, count in sorted(counter.items(), key=str)}
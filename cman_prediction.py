@@ -0,0 +1,62 @@
+import time
+
+from cman_game import Game, State, MAX_ATTEMPTS
+from cman_protocol import INPUT_SEQ_MODULO, seq_newer
+
+# Unacknowledged moves older than this are assumed lost and stop being replayed.
+PENDING_MOVE_TIMEOUT = 1.0
+
+
+class MovePredictor:
+    """
+
+    Runs the client's own moves through a local Game so they show up before the server confirms them.
+
+    Every move gets an input sequence number that the server echoes back in GAME_STATE_DELTA. When an
+    authoritative state arrives, acknowledged moves are dropped and the rest are replayed on top of it, so
+    a misprediction is rolled back by the next update.
+
+    """
+
+    def __init__(self, map_path, player):
+        self.game = Game(map_path)
+        self.player = player
+        self.input_seq = 0
+        self.pending_moves = []
+        self.attempts = 0
+
+    def next_input_seq(self, direction):
+        """Numbers a move about to be sent and applies it locally. Returns its input sequence number."""
+        self.input_seq = (self.input_seq + 1) % INPUT_SEQ_MODULO
+        self.pending_moves.append((self.input_seq, direction, time.monotonic()))
+        self.game.apply_move(self.player, direction)
+        return self.input_seq
+
+    def predicted_snapshot(self):
+        (c_row, c_col), (s_row, s_col) = self.game.cur_coords[0], self.game.cur_coords[1]
+        return bytes([c_row, c_col, s_row, s_col, self.attempts]) + self.game.get_collected_points_bytes()
+
+    def reconcile(self, freeze, input_ack, snapshot):
+        """Returns snapshot with the moves the server has not handled yet replayed on top of it."""
+        now = time.monotonic()
+        self.pending_moves = [(seq, direction, sent) for seq, direction, sent in self.pending_moves
+                              if seq_newer(seq, input_ack, INPUT_SEQ_MODULO) and now - sent < PENDING_MOVE_TIMEOUT]
+
+        self._load(freeze, snapshot)
+        for _, direction, _ in self.pending_moves:
+            self.game.apply_move(self.player, direction)
+        return self.predicted_snapshot()
+
+    def _load(self, freeze, snapshot):
+        game = self.game
+        game.cur_coords = [(snapshot[0], snapshot[1]), (snapshot[2], snapshot[3])]
+        self.attempts = snapshot[4]
+        game.collected_points = int.from_bytes(snapshot[5:], 'big')
+        for coord, bit in game.point_bits.items():
+            game.points[coord] = 0 if game.collected_points & bit else 1
+        # Score and lives only matter for the server's verdict; keeping them away from their limits means
+        # a replayed move never declares a winner locally.
+        game.score = 0
+        game.lives = MAX_ATTEMPTS
+        game.state = State.WAIT if freeze else State.PLAY
+        game.winner = None
@@ -0,0 +1,190 @@
+import struct
+
+from consts import GAME_STATE_UPDATE, GAME_STATE_DELTA
+from cman_game import MAX_ATTEMPTS
+
+# GAME_STATE_UPDATE layout: opcode, freeze, cman (row, col), ghost (row, col), attempts, 5 point bytes.
+STATE_UPDATE_FORMAT = '>BBBBBBB5s'
+STATE_UPDATE_LEN = struct.calcsize(STATE_UPDATE_FORMAT)
+FREEZE_OFFSET = 1
+
+
+class StateEncoder:
+    """
+
+    Encodes GAME_STATE_UPDATE messages for one Game into a preallocated buffer.
+
+    The payload is rebuilt only when Game.version changed since the previous call; recipients differ
+    only in the freeze byte, which is patched in place before each send.
+
+    """
+
+    def __init__(self):
+        self.message = bytearray(STATE_UPDATE_LEN)
+        self.version = None
+
+    def encode(self, game):
+        if game.version != self.version:
+            cman_coords, ghost_coords = game.cur_coords[0], game.cur_coords[1]
+            struct.pack_into(STATE_UPDATE_FORMAT, self.message, 0, GAME_STATE_UPDATE, self.message[FREEZE_OFFSET],
+                             *cman_coords, *ghost_coords, MAX_ATTEMPTS - game.lives, game.get_collected_points_bytes())
+            self.version = game.version
+        return self.message
+
+    def set_freeze(self, freeze):
+        self.message[FREEZE_OFFSET] = freeze
+        return self.message
+
+
+# GAME_STATE_DELTA layout: opcode, seq (2), base seq (2), freeze, input ack, field mask, then the masked fields
+# in order. A keyframe carries every field and has base seq == seq; an empty mask with base seq == seq repeats a
+# state. The input ack is the last PLAYER_MOVEMENT input sequence number the server handled for the recipient.
+DELTA_HEADER_FORMAT = '>BHHBBB'
+DELTA_HEADER_LEN = struct.calcsize(DELTA_HEADER_FORMAT)
+DELTA_FREEZE_OFFSET = 5
+DELTA_INPUT_ACK_OFFSET = 6
+INPUT_SEQ_MODULO = 1 << 8
+DEFAULT_KEYFRAME_INTERVAL = 32
+# Receivers acknowledge every this many states, or at once after a gap. Deltas are encoded against the last
+# acknowledged state, so a sparser ack only makes them a little larger.
+STATE_ACK_INTERVAL = 4
+SEQ_MODULO = 1 << 16
+
+# Snapshot byte ranges covered by each mask bit: cman, ghost, attempts, then the 5 point bytes.
+SNAPSHOT_LEN = STATE_UPDATE_LEN - 2
+SNAPSHOT_FIELDS = [(0, 2), (2, 4), (4, 5), (5, 6), (6, 7), (7, 8), (8, 9), (9, 10)]
+ALL_FIELDS = (1 << len(SNAPSHOT_FIELDS)) - 1
+
+
+def seq_newer(seq, other, modulo=SEQ_MODULO):
+    """Whether seq comes after other, allowing for wrap-around."""
+    return seq != other and (seq - other) % modulo < modulo // 2
+
+
+def encode_delta(seq, base_seq, base, snapshot):
+    mask = 0
+    fields = bytearray()
+    for bit, (start, end) in enumerate(SNAPSHOT_FIELDS):
+        if base is None or base[start:end] != snapshot[start:end]:
+            mask |= 1 << bit
+            fields += snapshot[start:end]
+    return bytearray(struct.pack(DELTA_HEADER_FORMAT, GAME_STATE_DELTA, seq, base_seq, 0, 0, mask)) + fields
+
+
+class DeltaEncoder:
+    """
+
+    Numbers every new game state and encodes it relative to whichever older state a recipient acknowledged.
+
+    Only the last keyframe_interval states are kept, recipients whose acknowledged state has fallen out of
+    that window get a keyframe, and every keyframe_interval-th state is sent as a keyframe to everyone.
+
+    """
+
+    def __init__(self, state_encoder=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.state_encoder = state_encoder
+        self.keyframe_interval = keyframe_interval
+        self.version = None
+        self.seq = 0
+        self.snapshots = {}
+        self.messages = {}
+
+    def update(self, game):
+        if game.version == self.version:
+            return
+
+        message = self.state_encoder.encode(game)
+        self.version = game.version
+        self.push(bytes(message[2:]))
+
+    def push(self, snapshot):
+        """Records snapshot as the newest state, unless it equals the current one."""
+        if self.snapshots.get(self.seq) == snapshot:
+            return
+
+        self.seq = (self.seq + 1) % SEQ_MODULO
+        self.snapshots[self.seq] = snapshot
+        _trim(self.snapshots, self.keyframe_interval)
+        self.messages = {}
+
+    def encode(self, base_seq):
+        """Returns the delta from base_seq (None for a keyframe) to the current state, with a patchable freeze byte."""
+        if self.seq % self.keyframe_interval == 0 or base_seq not in self.snapshots:
+            base_seq = None
+
+        message = self.messages.get(base_seq)
+        if message is None:
+            snapshot = self.snapshots[self.seq]
+            if base_seq is None:
+                message = encode_delta(self.seq, self.seq, None, snapshot)
+            else:
+                message = encode_delta(self.seq, base_seq, self.snapshots[base_seq], snapshot)
+            self.messages[base_seq] = message
+        return message
+
+
+class DeltaDecoder:
+    """
+
+    Rebuilds full snapshots from GAME_STATE_DELTA messages on the receiving side.
+
+    Keeps the states it may still be sent deltas against, counts gaps in the sequence, and decides when the
+    receiver acknowledges a state.
+
+    """
+
+    def __init__(self, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, ack_interval=STATE_ACK_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.ack_interval = ack_interval
+        self.last_seq = None
+        self.snapshots = {}
+        self.gaps = 0
+        self.acked_seq = None
+        self.ack_needed = False
+
+    def decode(self, message):
+        """Returns (freeze, input_ack, snapshot) for a usable delta, or None for a stale one or one whose base is unknown."""
+        seq, base_seq, freeze, input_ack, mask = struct.unpack_from(DELTA_HEADER_FORMAT, message)[1:]
+        if self.last_seq is not None and seq_newer(self.last_seq, seq):
+            return None
+
+        if base_seq == seq and mask == ALL_FIELDS:
+            snapshot = bytearray(SNAPSHOT_LEN)
+        elif base_seq in self.snapshots:
+            snapshot = bytearray(self.snapshots[base_seq])
+        else:
+            self.gaps += 1
+            self.ack_needed = True
+            return None
+
+        offset = DELTA_HEADER_LEN
+        for bit, (start, end) in enumerate(SNAPSHOT_FIELDS):
+            if mask & (1 << bit):
+                snapshot[start:end] = message[offset:offset + end - start]
+                offset += end - start
+
+        if self.last_seq is not None and seq_newer(seq, (self.last_seq + 1) % SEQ_MODULO):
+            self.gaps += 1
+            self.ack_needed = True
+        self.last_seq = seq
+        self.snapshots[seq] = bytes(snapshot)
+        _trim(self.snapshots, self.keyframe_interval)
+        return freeze, input_ack, self.snapshots[seq]
+
+    def next_ack(self):
+        """Returns the sequence number to put in a STATE_ACK if one is due, otherwise None."""
+        if self.last_seq is None:
+            # Nothing decoded yet; acking 0 gets a keyframe.
+            return 0
+        if not self.ack_needed and self.acked_seq is not None and \
+                (self.last_seq - self.acked_seq) % SEQ_MODULO < self.ack_interval:
+            return None
+        self.acked_seq = self.last_seq
+        self.ack_needed = False
+        return self.last_seq
+
+
+def _trim(snapshots, size):
+    # Dicts keep insertion order, so the first keys are the oldest states.
+    while len(snapshots) > size:
+        del snapshots[next(iter(snapshots))]
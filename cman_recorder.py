@@ -0,0 +1,82 @@
+import mmap
+import socket
+import struct
+
+MAGIC = b'CMRC'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '>4sB'
+HEADER_LEN = struct.calcsize(HEADER_FORMAT)
+# Monotonic time in seconds, kind, client ip, client port, data length.
+RECORD_FORMAT = '>dB4sHH'
+RECORD_LEN = struct.calcsize(RECORD_FORMAT)
+
+# Record kinds. A MESSAGE is an accepted JOIN, PLAYER_MOVEMENT or QUIT (moves once they are applied), an
+# EVICT is an idle client the server dropped, and a BROADCAST is a point where the server sent the status of
+# the rooms it had touched. Rooms are reset by the message or eviction that ends their match, and replaying
+# the broadcasts keeps the state sequence numbers of the replay in step with the recorded server.
+# BOT_JOIN (room id) and BOT_MOVE (room id, direction) are the ghost bot's doings, which have no client address.
+MESSAGE = 0
+EVICT = 1
+BROADCAST = 2
+BOT_JOIN = 3
+BOT_MOVE = 4
+
+RECORD_BUFFER_SIZE = 1 << 16
+# How often buffered records are pushed to the file, in seconds.
+RECORD_FLUSH_INTERVAL = 1.0
+
+
+class Recorder:
+    """
+
+    Appends records to a binary log through a large write buffer, so recording costs the server a
+    struct.pack and a memory copy per message.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb', buffering=RECORD_BUFFER_SIZE)
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION))
+        self.records = 0
+
+    def record(self, now, kind, address=('0.0.0.0', 0), data=b''):
+        self.file.write(struct.pack(RECORD_FORMAT, now, kind, socket.inet_aton(address[0]), address[1], len(data)))
+        self.file.write(bytes(data))
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    """
+
+    A log written by Recorder, memory-mapped for reading. Iterating yields (time, kind, address, data) tuples.
+
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mapping) < HEADER_LEN or struct.unpack_from(HEADER_FORMAT, self.mapping) != (MAGIC, FORMAT_VERSION):
+            self.mapping.close()
+            raise ValueError(f'{path} is not a recording')
+
+    def __iter__(self):
+        mapping = self.mapping
+        offset = HEADER_LEN
+        # A record cut short by a crash ends the recording.
+        while offset + RECORD_LEN <= len(mapping):
+            now, kind, ip, port, length = struct.unpack_from(RECORD_FORMAT, mapping, offset)
+            offset += RECORD_LEN
+            if offset + length > len(mapping):
+                return
+            yield now, kind, (socket.inet_ntoa(ip), port), mapping[offset:offset + length]
+            offset += length
+
+    def close(self):
+        self.mapping.close()
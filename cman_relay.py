@@ -0,0 +1,12 @@
+from arg_parser import ArgParser as ap
+from cman_relay_impl import CManRelay
+
+
+def main():
+    addr, port, listen_port, room, idle_timeout = ap().relay_parse_arguments()
+    cman_relay = CManRelay((addr, port), listen_port, room, idle_timeout)
+    cman_relay.start_relay()
+
+
+if __name__ == "__main__":
+    main()
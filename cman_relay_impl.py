@@ -0,0 +1,265 @@
+import socket
+
+from consts import ERROR_DICT, SERVER_ADDR, BUFFER_SIZE, HEARTBEAT_INTERVAL, JOIN, PLAYER_MOVEMENT, STATE_ACK, HEARTBEAT, RELIABLE_MESSAGE, RELIABLE_ACK, QUIT, \
+    GAME_STATE_UPDATE, GAME_STATE_DELTA, SERVER_RELIABLE_MESSAGE, SERVER_RELIABLE_ACK, GAME_END, ERROR
+from cman_event_loop import EventLoop
+from cman_protocol import DeltaDecoder, DeltaEncoder, DELTA_FREEZE_OFFSET, seq_newer
+from cman_reliable import ReliableChannel
+from cman_session import SessionTable
+from cman_server_impl import GAME_END_REPEATS, GAME_END_INTERVAL, _create_bytes_message
+
+# How often the relay repeats its spectator JOIN until the upstream answers.
+JOIN_RETRY_INTERVAL = 1.0
+# Watchers that sent nothing for this many seconds are dropped. Clients heartbeat every HEARTBEAT_INTERVAL.
+DEFAULT_RELAY_IDLE_TIMEOUT = 30.0
+
+
+class CManRelay:
+    """
+
+    Joins an upstream server (or another relay) once as a spectator and re-broadcasts its updates to
+    spectators of its own.
+
+    Downstream, the relay speaks the server's spectator protocol: JOIN as a spectator, STATE_ACK for
+    deltas and QUIT. So relays can be chained, and each one takes its watchers' fan-out off the
+    authoritative server.
+
+    """
+
+    def __init__(self, upstream_address, port, room=None, idle_timeout=DEFAULT_RELAY_IDLE_TIMEOUT):
+        self.upstream_address = upstream_address
+        self.port = port
+        self.room = room
+        self.idle_timeout = idle_timeout
+        self.upstream_socket = None
+        self.server_socket = None
+        self.loop = EventLoop()
+        # A session per watcher, like the server's: its acked_seq is None until it asks for deltas.
+        self.watchers = SessionTable()
+        self.snapshot = None
+        self.upstream_deltas = DeltaDecoder()
+        self.delta_encoder = DeltaEncoder()
+        self.join_timer = None
+        # Acks the upstream's GAME_END, and carries GAME_END to the relay's own watchers.
+        self.upstream_reliable = ReliableChannel(self.loop, lambda message, _: self._send_upstream(message),
+                                                 RELIABLE_MESSAGE, RELIABLE_ACK)
+        self.reliable = ReliableChannel(self.loop, self._send_message, SERVER_RELIABLE_MESSAGE, SERVER_RELIABLE_ACK)
+
+    def start_relay(self):
+        try:
+            self.upstream_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error as e:
+            print(f'Failed to create socket. Error: {e}. Exiting...')
+            exit()
+        self.upstream_socket.connect(self.upstream_address)
+        self.server_socket.bind((SERVER_ADDR, self.port))
+        self.upstream_socket.setblocking(False)
+        self.server_socket.setblocking(False)
+
+        print(f"Relay for {self.upstream_address[0]}:{self.upstream_address[1]} is running on {SERVER_ADDR}:{self.port}")
+
+        self.loop.add_reader(self.upstream_socket, self._on_upstream_readable)
+        self.loop.add_reader(self.server_socket, self._on_readable)
+        self._join_upstream()
+        self.loop.call_later(HEARTBEAT_INTERVAL, self._heartbeat_upstream)
+        self.loop.call_later(self.idle_timeout / 2, self._evict_idle_watchers)
+        try:
+            self.loop.run_forever()
+
+        except KeyboardInterrupt:
+            print("\nRelay shutting down...")
+
+        finally:
+            self._send_upstream(bytes([QUIT]))
+            self.loop.close()
+            self.upstream_socket.close()
+            self.server_socket.close()
+
+    # Upstream
+    def _join_upstream(self):
+        join_data = bytes([JOIN, 0x00])
+        if self.room is not None:
+            join_data += self.room.to_bytes(2, 'big')
+        self._send_upstream(join_data)
+        self.join_timer = self.loop.call_later(JOIN_RETRY_INTERVAL, self._join_upstream)
+
+    def _joined_upstream(self):
+        if self.join_timer is not None:
+            self.join_timer.cancel()
+            self.join_timer = None
+
+    def _on_upstream_readable(self):
+        while True:
+            try:
+                data = self.upstream_socket.recv(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                # The upstream is not there (yet); the JOIN retry timer keeps trying.
+                print(f'Failed to receive data from upstream: {e}')
+                return
+            if data:
+                self._handle_upstream_message(data)
+
+    def _handle_upstream_message(self, data):
+        op_code = data[0]
+        if op_code == GAME_STATE_UPDATE:
+            self._joined_upstream()
+            self._relay_state(bytes(data[2:]))
+            self._ack_upstream()
+        elif op_code == GAME_STATE_DELTA:
+            self._joined_upstream()
+            decoded = self.upstream_deltas.decode(data)
+            if decoded is not None:
+                self._relay_state(decoded[2])
+            seq = self.upstream_deltas.next_ack()
+            if seq is not None:
+                self._send_upstream(bytes([STATE_ACK]) + seq.to_bytes(2, 'big'))
+        elif op_code == GAME_END:
+            self._relay_game_end(data)
+        elif op_code == SERVER_RELIABLE_MESSAGE and len(data) > 3:
+            message = self.upstream_reliable.receive(data, self.upstream_address)
+            if message is not None:
+                self._handle_upstream_message(message)
+        elif op_code == ERROR:
+            err_code = data[-1]
+            print(f"Upstream error: {ERROR_DICT[err_code] if err_code < len(ERROR_DICT) else 'Unknown error'}")
+
+    def _heartbeat_upstream(self):
+        self._send_upstream(bytes([HEARTBEAT]))
+        self.loop.call_later(HEARTBEAT_INTERVAL, self._heartbeat_upstream)
+
+    def _ack_upstream(self):
+        last_seq = self.upstream_deltas.last_seq
+        self._send_upstream(bytes([STATE_ACK]) + (last_seq if last_seq is not None else 0).to_bytes(2, 'big'))
+
+    def _send_upstream(self, message):
+        try:
+            self.upstream_socket.send(message)
+        except socket.error as e:
+            print(f'Failed to send message upstream. Error: {e}')
+
+    # Downstream
+    def _on_readable(self):
+        while True:
+            try:
+                data, client_address = self.server_socket.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                print(f'Failed to receive data from client: {e}')
+                return
+            error = self._process_data(data, client_address)
+            if error is not None:
+                self._send_message(_create_bytes_message(ERROR, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, error), client_address)
+
+    def _process_data(self, data, client_address):
+        if not data:
+            return 1
+        prefix = data[0]
+
+        if prefix == RELIABLE_MESSAGE:
+            if len(data) < 4 or data[3] not in [JOIN, QUIT]:
+                return 13
+            message = self.reliable.receive(data, client_address)
+            if message is None:
+                return
+            error = self._process_data(message, client_address)
+            watcher = self.watchers.get(client_address)
+            if message[0] == JOIN and watcher is not None:
+                watcher.reliable = True
+            return error
+
+        if prefix == RELIABLE_ACK:
+            if len(data) != 3:
+                return 13
+            self.reliable.acked(client_address, (data[1] << 8) | data[2])
+            return
+
+        if prefix == JOIN:
+            if len(data) not in [2, 4] or data[1] != 0x00:
+                return 2
+            if client_address in self.watchers:
+                return 3
+            self.reliable.cancel(client_address)
+            watcher = self.watchers.add(client_address, 0x00, None, self.loop.time())
+            if self.snapshot is not None:
+                self._send_state(watcher)
+            return
+
+        watcher = self.watchers.touch(client_address, self.loop.time())
+        if watcher is None:
+            return 2
+
+        if prefix == STATE_ACK:
+            if len(data) != 3:
+                return 10
+            seq = (data[1] << 8) | data[2]
+            if watcher.acked_seq is None or seq_newer(seq, watcher.acked_seq):
+                watcher.acked_seq = seq
+            return
+
+        if prefix == HEARTBEAT:
+            return 11 if len(data) != 1 else None
+
+        if prefix == PLAYER_MOVEMENT:
+            return 8
+
+        if prefix == QUIT:
+            self.watchers.remove(client_address)
+            return
+
+        return 1
+
+    def _relay_state(self, snapshot):
+        self.snapshot = snapshot
+        self.delta_encoder.push(snapshot)
+        full_message = bytes([GAME_STATE_UPDATE, 0x01]) + snapshot
+        for watcher in self.watchers:
+            self._send_state(watcher, full_message)
+
+    def _send_state(self, watcher, full_message=None):
+        if watcher.acked_seq is None:
+            message = full_message or bytes([GAME_STATE_UPDATE, 0x01]) + self.snapshot
+        else:
+            message = self.delta_encoder.encode(watcher.acked_seq)
+            message[DELTA_FREEZE_OFFSET] = 0x01
+        self._send_message(message, watcher.address)
+
+    def _evict_idle_watchers(self):
+        # A crashed watcher never sends QUIT, and would otherwise be sent every update for good.
+        self.loop.call_later(self.idle_timeout / 2, self._evict_idle_watchers)
+        for watcher in self.watchers.idle_sessions(self.loop.time(), self.idle_timeout):
+            print(f"Evicting idle watcher {watcher.address}")
+            self.watchers.remove(watcher.address)
+
+    def _relay_game_end(self, message):
+        # The upstream forgets its spectators when a match ends, so the relay re-joins for the next one
+        # and sends GAME_END to its own watchers the way the server does.
+        print("Match ended upstream, relaying GAME_END and re-joining")
+        reliable_recipients = [watcher.address for watcher in self.watchers if watcher.reliable]
+        plain_recipients = [watcher.address for watcher in self.watchers if not watcher.reliable]
+        self.watchers = SessionTable()
+        self.snapshot = None
+        self.upstream_deltas = DeltaDecoder()
+        for recipient in reliable_recipients:
+            self.reliable.send(message, recipient)
+        if plain_recipients:
+            self._repeat_game_end(bytes(message), plain_recipients, GAME_END_REPEATS)
+        self._joined_upstream()
+        self._join_upstream()
+
+    def _repeat_game_end(self, message, recipients, repeats_left):
+        for recipient in recipients:
+            if recipient not in self.watchers:
+                self._send_message(message, recipient)
+
+        if repeats_left > 1:
+            self.loop.call_later(GAME_END_INTERVAL, self._repeat_game_end, message, recipients, repeats_left - 1)
+
+    def _send_message(self, message, client):
+        try:
+            self.server_socket.sendto(message, client)
+        except socket.error as e:
+            print(f'Failed to send message to {client}. Error: {e}')
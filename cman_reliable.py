@@ -0,0 +1,125 @@
+import random
+from collections import OrderedDict
+
+# A message is retransmitted after this many seconds without an ack, doubling up to the maximum.
+RETRANSMIT_TIMEOUT = 0.2
+MAX_RETRANSMIT_TIMEOUT = 1.6
+# Seconds after which an unacknowledged message is given up on.
+GIVE_UP_TIMEOUT = 5.0
+# Received sequence numbers are remembered this long, which covers every retransmit of their message.
+SEEN_TIMEOUT = 2 * GIVE_UP_TIMEOUT
+SEQ_MODULO = 1 << 16
+# Envelope layout: opcode, 2 byte sequence number, then the message.
+ENVELOPE_HEADER_LEN = 3
+
+
+class _Pending:
+
+    __slots__ = ('envelope', 'deadline', 'on_done', 'timer')
+
+    def __init__(self, envelope, deadline, on_done):
+        self.envelope = envelope
+        self.deadline = deadline
+        self.on_done = on_done
+        self.timer = None
+
+
+class ReliableChannel:
+    """
+
+    Acknowledged delivery for the few control messages that must not be lost, on top of plain datagrams.
+
+    send() wraps a message in an envelope with a sequence number and retransmits it with exponential
+    backoff until the peer acks it or GIVE_UP_TIMEOUT passes. receive() acks an envelope from a peer and
+    unwraps it, dropping the retransmits of a message it already returned.
+
+    envelope_opcode and ack_opcode are the opcodes this side sends, so the client and server directions
+    of the protocol keep separate ones. loop is anything with EventLoop's time and call_later.
+
+    """
+
+    def __init__(self, loop, send, envelope_opcode, ack_opcode):
+        self.loop = loop
+        self.send_datagram = send
+        self.envelope_opcode = envelope_opcode
+        self.ack_opcode = ack_opcode
+        # Starting at a random number keeps a new process on a reused address from looking like a retransmit.
+        self.next_seq = random.randrange(SEQ_MODULO)
+        # Address -> sequence number -> _Pending.
+        self.pending = {}
+        # (address, sequence number) -> receive time, oldest first.
+        self.seen = OrderedDict()
+        self.retransmits = 0
+        self.given_up = 0
+        self.duplicates = 0
+
+    def send(self, message, address, on_done=None):
+        """Sends message reliably. on_done, if given, is called with True once it is acked, or False on giving up."""
+        seq = self.next_seq
+        self.next_seq = (seq + 1) % SEQ_MODULO
+        envelope = bytes([self.envelope_opcode]) + seq.to_bytes(2, 'big') + bytes(message)
+        pending = _Pending(envelope, self.loop.time() + GIVE_UP_TIMEOUT, on_done)
+        self.pending.setdefault(address, {})[seq] = pending
+        self._transmit(address, seq, pending, RETRANSMIT_TIMEOUT)
+
+    def _transmit(self, address, seq, pending, timeout):
+        self.send_datagram(pending.envelope, address)
+        delay = min(timeout, pending.deadline - self.loop.time())
+        pending.timer = self.loop.call_later(delay, self._on_timeout, address, seq, pending, timeout)
+
+    def _on_timeout(self, address, seq, pending, timeout):
+        if self.loop.time() < pending.deadline:
+            self.retransmits += 1
+            self._transmit(address, seq, pending, min(timeout * 2, MAX_RETRANSMIT_TIMEOUT))
+            return
+
+        self.given_up += 1
+        self._remove(address, seq)
+        if pending.on_done is not None:
+            pending.on_done(False)
+
+    def acked(self, address, seq):
+        pending = self._remove(address, seq)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        if pending.on_done is not None:
+            pending.on_done(True)
+
+    def cancel(self, address):
+        """Stops retransmitting everything sent to address, without calling on_done."""
+        for pending in self.pending.pop(address, {}).values():
+            pending.timer.cancel()
+
+    def _remove(self, address, seq):
+        messages = self.pending.get(address)
+        if messages is None:
+            return None
+        pending = messages.pop(seq, None)
+        if not messages:
+            del self.pending[address]
+        return pending
+
+    def receive(self, envelope, address):
+        """Acks an envelope and returns the message in it, or None if it was already received."""
+        envelope = bytes(envelope)
+        self.send_datagram(bytes([self.ack_opcode]) + envelope[1:ENVELOPE_HEADER_LEN], address)
+
+        now = self.loop.time()
+        while self.seen and next(iter(self.seen.values())) < now - SEEN_TIMEOUT:
+            self.seen.popitem(last=False)
+
+        key = (address, int.from_bytes(envelope[1:ENVELOPE_HEADER_LEN], 'big'))
+        if key in self.seen:
+            self.duplicates += 1
+            return None
+        self.seen[key] = now
+        return envelope[ENVELOPE_HEADER_LEN:]
+
+    def get_stats(self):
+        return {
+            'pending': sum(len(messages) for messages in self.pending.values()),
+            'retransmits': self.retransmits,
+            'given_up': self.given_up,
+            'duplicates': self.duplicates,
+        }
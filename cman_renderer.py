@@ -0,0 +1,80 @@
+import sys
+import time
+
+CLEAR_SCREEN = "\033[H\033[J"
+CLEAR_LINE = "\033[K"
+
+
+def _move_to(row, col):
+    # Terminal rows and columns are 1-based.
+    return f"\033[{row + 1};{col + 1}H"
+
+
+class TerminalRenderer:
+    """
+
+    Draws the client's status lines and WorldMap, rewriting only what changed since the last frame.
+
+    The first frame, and the first one after invalidate(), clears the screen and draws everything. After
+    that, changed status lines and map cells are written in place with cursor-addressing escapes, so an
+    update costs a few cells instead of the whole map. With max_fps, a frame requested too soon is
+    deferred and pending is set until render() is called again.
+
+    """
+
+    def __init__(self, max_fps=None, out=sys.stdout):
+        self.min_frame_interval = 1.0 / max_fps if max_fps else 0.0
+        self.out = out
+        # What is currently on screen, None until a full frame has been drawn.
+        self.header = None
+        self.screen = None
+        self.last_frame = float('-inf')
+        self.pending = False
+        self.bytes_written = 0
+
+    def invalidate(self):
+        """Makes the next frame a full redraw, for when something else has written to the terminal."""
+        self.header = None
+
+    def render(self, header, world_map):
+        now = time.monotonic()
+        if now - self.last_frame < self.min_frame_interval:
+            self.pending = True
+            return
+        self.last_frame = now
+        self.pending = False
+
+        if self.header is None or len(header) != len(self.header):
+            frame = self._full_frame(header, world_map)
+        else:
+            frame = self._diff_frame(header, world_map)
+        if not frame:
+            return
+
+        # Park the cursor under the map so anything printed later does not land on it.
+        frame += _move_to(len(self.header) + len(self.screen), 0)
+        self.out.write(frame)
+        self.out.flush()
+        self.bytes_written += len(frame.encode())
+
+    def _full_frame(self, header, world_map):
+        world_map.take_dirty_cells()
+        self.header = list(header)
+        self.screen = [list(row) for row in world_map.matrix]
+        return CLEAR_SCREEN + '\n'.join(self.header + [''.join(row) for row in self.screen])
+
+    def _diff_frame(self, header, world_map):
+        parts = []
+        for row, line in enumerate(header):
+            if line != self.header[row]:
+                self.header[row] = line
+                parts.append(_move_to(row, 0) + line + CLEAR_LINE)
+
+        top = len(self.header)
+        for row, col in sorted(world_map.take_dirty_cells()):
+            value = world_map.matrix[row][col]
+            # A cell can be written and restored between frames (a player that moved away and back).
+            if self.screen[row][col] != value:
+                self.screen[row][col] = value
+                parts.append(_move_to(top + row, col) + value)
+        return ''.join(parts)
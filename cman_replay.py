@@ -0,0 +1,117 @@
+import contextlib
+import hashlib
+import os
+import time
+
+from arg_parser import ArgParser as ap
+from cman_server_impl import CManServer
+from cman_recorder import Recording, MESSAGE, EVICT, BOT_JOIN, BOT_MOVE
+
+
+class ReplayServer(CManServer):
+    """
+
+    A CManServer fed from a recording instead of a socket. Everything it would send is only counted.
+
+    Messages go through the same _process_data as live traffic, and broadcasts happen where the recording
+    has them, so the rooms end up in the state the recorded server left them in.
+
+    """
+
+    def __init__(self, **server_options):
+        super().__init__(None, **server_options)
+        self.records = 0
+
+    def replay(self, kind, address, data):
+        self.records += 1
+        if kind == MESSAGE:
+            self.metrics.received(data)
+            self._apply_datagram(data, address)
+        elif kind == EVICT:
+            session = self.sessions.get(address)
+            if session is not None:
+                self._evict_session(session)
+        elif kind == BOT_JOIN:
+            self._seat_ghost_bot(self.rooms[int.from_bytes(data[:2], 'big')])
+        elif kind == BOT_MOVE:
+            self._move_ghost_bot(self.rooms[int.from_bytes(data[:2], 'big')], data[2])
+        else:
+            rooms = self.touched_rooms | self.dirty_rooms
+            self.touched_rooms.clear()
+            self.dirty_rooms.clear()
+            self._send_status_message(rooms)
+            self.metrics.handled()
+
+    def replay_as_fast_as_possible(self, recording):
+        for _, kind, address, data in recording:
+            self.replay(kind, address, data)
+
+    def replay_in_time(self, recording, speed):
+        # GAME_END repeats and the other timers run on the loop too.
+        records = iter(recording)
+        first = next(records, None)
+        if first is None:
+            return
+        start = self.loop.time()
+        self.loop.call_later(0, self._replay_next, records, first, start - first[0] / speed, speed)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _replay_next(self, records, record, offset, speed):
+        _, kind, address, data = record
+        self.replay(kind, address, data)
+        record = next(records, None)
+        if record is None:
+            self.loop.stop()
+            return
+        self.loop.call_at(offset + record[0] / speed, self._replay_next, records, record, offset, speed)
+
+    def state_digest(self):
+        """A hash of every room's players and game, equal for two replays that ended in the same state."""
+        digest = hashlib.sha256()
+        for room_id, room in sorted(self.rooms.items()):
+            game = room.game
+            digest.update(repr((room_id, room.game_status, room.cman, room.ghost, sorted(room.watchers),
+                                game.cur_cells, game.collected_points, game.score, game.lives, game.state,
+                                game.get_winner())).encode())
+        return digest.hexdigest()
+
+    def _send_message(self, message, client):
+        self.metrics.sent(message)
+
+
+def main():
+    path, speed = ap().replay_parse_arguments()
+    try:
+        recording = Recording(path)
+    except (OSError, ValueError) as e:
+        print(f'Failed to open recording {path}. Error: {e}. Exiting...')
+        exit()
+
+    server = ReplayServer()
+    start = time.perf_counter()
+    try:
+        if speed:
+            server.replay_in_time(recording, speed)
+        else:
+            # The server prints every join and game end, which would cost more than the replay itself.
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                server.replay_as_fast_as_possible(recording)
+    finally:
+        recording.close()
+    elapsed = time.perf_counter() - start
+
+    metrics = server.metrics
+    processing = metrics.processing_us.snapshot()
+    print(f"Replayed {server.records} records in {elapsed:.3f}s ({server.records / max(elapsed, 1e-9):.0f} records/s)")
+    print(f"Messages:        {sum(metrics.packets_in.values())} in, {sum(metrics.packets_out.values())} out "
+          f"({sum(metrics.bytes_out.values())} bytes)")
+    print(f"Processing:      p50 <{processing['p50']}us  p99 <{processing['p99']}us")
+    print(f"Rooms:           {len(server.rooms)} open, {len(server.sessions)} sessions")
+    print(f"State digest:    {server.state_digest()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from enum import IntEnum
+
+from cman_game import Game
+from cman_protocol import StateEncoder, DeltaEncoder, DEFAULT_KEYFRAME_INTERVAL
+
+
+class GameStatus(IntEnum):
+    PREGAME = 0
+    WAITING = 1
+    PLAYING = 2
+    START = 3
+    END = 4
+
+
+class Room:
+    """
+
+    A single match hosted by the server: its Game instance and the addresses taking part in it.
+
+    """
+
+    def __init__(self, room_id, map_path, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.room_id = room_id
+        self.game = Game(map_path)
+        self.state_encoder = StateEncoder()
+        self.delta_encoder = DeltaEncoder(self.state_encoder, keyframe_interval)
+        self.game_status = GameStatus.PREGAME
+        self.cman = None
+        self.ghost = None
+        # Whether the server's ghost bot plays the ghost. It has no address, so ghost stays None.
+        self.ghost_is_bot = False
+        # Spectator address -> Session.
+        self.watchers = {}
+
+    def participants(self):
+        players = [player for player in (self.cman, self.ghost) if player is not None]
+        return list(self.watchers) + players
+
+    def has_ghost(self):
+        return self.ghost is not None or self.ghost_is_bot
+
+    def is_empty(self):
+        return self.cman is None and self.ghost is None and not self.watchers
@@ -1,10 +1,26 @@
 from arg_parser import ArgParser as ap
 from cman_server_impl import CManServer
+from cman_server_async import AsyncCManServer
+from cman_workers import run_workers
 
 
 def main():
-    port = ap().server_parse_arguments()
-    cman_server = CManServer(port)
+    args = ap().server_parse_arguments()
+    server_options = dict(tick_hz=args.tick_hz, recv_budget=args.recv_budget, keyframe_interval=args.keyframe_interval,
+                          idle_timeout=args.idle_timeout, metrics_file=args.metrics_file,
+                          metrics_interval=args.metrics_interval, record_path=args.record,
+                          ghost_bot=args.ghost_bot, ghost_bot_hz=args.ghost_bot_hz, move_hz=args.move_hz,
+                          move_queue_len=args.move_queue, input_rate=args.input_rate, input_burst=args.input_burst)
+    if args.workers > 1:
+        if args.engine != "select":
+            print("Workers only run on the select engine. Exiting...")
+            exit()
+        run_workers(args.port, args.workers, server_options)
+        return
+    if args.engine == "select":
+        cman_server = CManServer(args.port, **server_options)
+    else:
+        cman_server = AsyncCManServer(args.port, use_uvloop=args.engine == "uvloop", **server_options)
     cman_server.start_server()
 
 
@@ -0,0 +1,82 @@
+import asyncio
+import signal
+import socket
+
+from consts import SERVER_ADDR
+from cman_server_impl import CManServer
+
+
+class AsyncCManServer(CManServer):
+    """
+
+    CManServer running on asyncio instead of EventLoop.
+
+    The request handling is inherited unchanged: the asyncio loop stands in for EventLoop (same time,
+    call_later and add_reader API). The server socket is watched with add_reader rather than wrapped in a
+    datagram transport, which would deliver one datagram per callback, so the inherited _on_readable drains
+    it in batches of up to recv_budget datagrams exactly as on the select engine.
+
+    spawn() lets other coroutines (metrics, relays, persistence) run next to packet handling. With
+    use_uvloop the loop comes from uvloop, which must be installed.
+
+    """
+
+    def __init__(self, port, use_uvloop=False, **server_options):
+        # The loop is created in CManServer.__init__, through _create_loop.
+        self.use_uvloop = use_uvloop
+        super().__init__(port, **server_options)
+        self.tasks = set()
+        self.stopped = None
+
+    def _create_loop(self):
+        if not self.use_uvloop:
+            return asyncio.new_event_loop()
+        try:
+            import uvloop
+        except ImportError:
+            print('uvloop is not installed. Exiting...')
+            exit()
+        return uvloop.new_event_loop()
+
+    def start_server(self):
+        # The loop already exists, so the timers and the reliable channel are bound to the one that runs.
+        with asyncio.Runner(loop_factory=lambda: self.loop) as runner:
+            runner.run(self.serve())
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        try:
+            self.server_socket = self._create_socket()
+        except socket.error as e:
+            print(f'Failed to create socket. Error: {e}. Exiting...')
+            exit()
+        self.server_socket.bind((SERVER_ADDR, self.port))
+        self.server_socket.setblocking(False)
+        self.loop.add_reader(self.server_socket, self._on_readable)
+
+        print(f"UDP server ({type(self.loop).__module__}) is running on {SERVER_ADDR}:{self.port}")
+        print("Game is starting...")
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stop)
+        self._start_timers()
+        try:
+            await self.stopped.wait()
+            print("\nServer shutting down...")
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            self._print_batch_stats()
+            self._stop_recording()
+            self.loop.remove_reader(self.server_socket)
+            self.server_socket.close()
+
+    def stop(self):
+        self.stopped.set()
+
+    def spawn(self, coroutine):
+        # The loop only keeps weak references to tasks, so they are held here until they finish.
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
@@ -1,248 +1,604 @@
+import json
+import signal
 import socket
-import select
-from enum import IntEnum
 
-from consts import ERROR_DICT, SERVER_ADDR, MAP_PATH, BUFFER_SIZE, JOIN, PLAYER_MOVEMENT, QUIT, GAME_STATE_UPDATE, GAME_END, ERROR
-import time
+from consts import ERROR_DICT, SERVER_ADDR, MAP_PATH, BUFFER_SIZE, DEFAULT_ROOM, DEFAULT_RECV_BUDGET, DEFAULT_MOVE_QUEUE_LEN, DEFAULT_INPUT_BURST, JOIN, PLAYER_MOVEMENT, STATE_ACK, HEARTBEAT, STATS, RELIABLE_MESSAGE, RELIABLE_ACK, QUIT, STATS_REPLY, SERVER_RELIABLE_MESSAGE, SERVER_RELIABLE_ACK, GAME_END, ERROR
 
-from cman_game import Game, Player, MAX_ATTEMPTS
+from cman_game import Player, MAX_ATTEMPTS
+from cman_event_loop import EventLoop
+from cman_room import Room, GameStatus
+from cman_session import SessionTable, TokenBucket
+from cman_metrics import ServerMetrics, DEFAULT_METRICS_INTERVAL
+from cman_recorder import Recorder, MESSAGE, EVICT, BROADCAST, BOT_JOIN, BOT_MOVE, RECORD_FLUSH_INTERVAL
+from cman_reliable import ReliableChannel
+from cman_ghost_bot import GhostBot, next_step_table, DEFAULT_GHOST_BOT_HZ, GHOST_BOT_JOIN_DELAY
+from cman_protocol import DEFAULT_KEYFRAME_INTERVAL, DELTA_FREEZE_OFFSET, DELTA_INPUT_ACK_OFFSET, seq_newer
 
-
-class GameStatus(IntEnum):
-    PREGAME = 0
-    WAITING = 1
-    PLAYING = 2
-    START = 3
-    END = 4
+# Clients that joined without the reliable envelope get GAME_END this many times, this many seconds apart.
+GAME_END_REPEATS = 10
+GAME_END_INTERVAL = 1.0
 
 
 class CManServer:
 
-    def __init__(self, port):
+    def __init__(self, port, tick_hz=None, recv_budget=DEFAULT_RECV_BUDGET, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 idle_timeout=None, metrics_file=None, metrics_interval=DEFAULT_METRICS_INTERVAL, record_path=None,
+                 ghost_bot=None, ghost_bot_hz=DEFAULT_GHOST_BOT_HZ, move_hz=None, move_queue_len=DEFAULT_MOVE_QUEUE_LEN,
+                 input_rate=None, input_burst=DEFAULT_INPUT_BURST):
         self.port = port
-        self.watchers = []
-        self.cman = None
-        self.ghost = None
+        self.rooms = {}
+        self.sessions = SessionTable()
+        self.touched_rooms = set()
+        self.dirty_rooms = set()
+        self.tick_interval = 1.0 / tick_hz if tick_hz else None
+        self.recv_budget = recv_budget
+        self.keyframe_interval = keyframe_interval
+        self.idle_timeout = idle_timeout
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.metrics = ServerMetrics()
+        self.record_path = record_path
+        self.recorder = None
+        # ghost_bot is the bot's difficulty, or None to leave ghostless rooms waiting for a ghost client.
+        self.ghost_bot = GhostBot(next_step_table(MAP_PATH), ghost_bot) if ghost_bot is not None else None
+        self.ghost_bot_interval = 1.0 / ghost_bot_hz
+        self.bot_rooms = set()
+        # With a move rate, moves are queued per player and applied one per player per move tick.
+        self.move_interval = 1.0 / move_hz if move_hz else None
+        self.move_queue_len = move_queue_len
+        self.queued_sessions = set()
+        # With an input rate, each address gets a token bucket and moves beyond it are dropped.
+        self.input_rate = input_rate
+        self.input_burst = input_burst
         self.server_socket = None
-        self.game = Game(MAP_PATH)
-        self.game_status = GameStatus.PREGAME
+        self.loop = self._create_loop()
+        # Carries GAME_END to clients, and JOIN and QUIT from the clients that send them reliably.
+        self.reliable = ReliableChannel(self.loop, self._send_message, SERVER_RELIABLE_MESSAGE, SERVER_RELIABLE_ACK)
+
+    def _create_loop(self):
+        return EventLoop()
 
     def start_server(self):
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.server_socket = self._create_socket()
         except socket.error as e:
             print(f'Failed to create socket. Error: {e}. Exiting...')
             exit()
         server_address = (SERVER_ADDR, self.port)
         self.server_socket.bind(server_address)
+        self.server_socket.setblocking(False)
 
         print(f"UDP server is running on {SERVER_ADDR}:{self.port}")
 
         self.start_game()
 
+    def _create_socket(self):
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
     def start_game(self):
         print("Game is starting...")
+        self.loop.add_reader(self.server_socket, self._on_readable)
+        self._start_timers()
         try:
-            while True:
-                read_sockets, _, _ = select.select([self.server_socket], [], [], 0)
-
-                if len(read_sockets):
-                    try:
-                        data, client_address = self.server_socket.recvfrom(BUFFER_SIZE)
-                    except socket.error as e:
-                        print(f'Failed to receive data from client: {e}\nExiting...')
-                        exit()
-                    data_list = list(data)
-
-                    error = self._process_data(data_list, client_address)
-
-                    if error is not None:
-                        print(f"Error: {ERROR_DICT[error]}")
-                        self._send_error_message(error, client_address)
-
-                    self._send_status_message()
+            self.loop.run_forever()
 
         except KeyboardInterrupt:
             print("\nServer shutting down...")
 
         finally:
+            self._print_batch_stats()
+            self._stop_recording()
+            self.loop.remove_reader(self.server_socket)
+            self.loop.close()
             self.server_socket.close()
 
+    def _on_readable(self):
+        # Drain everything queued (up to the budget) and broadcast once for the whole batch.
+        batch_size = 0
+        while batch_size < self.recv_budget:
+            try:
+                data, client_address = self.server_socket.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            except socket.error as e:
+                print(f'Failed to receive data from client: {e}\nExiting...')
+                exit()
+            batch_size += 1
+            self.metrics.received(data)
+            self._receive_datagram(data, client_address)
+
+        if batch_size:
+            self.metrics.batch_sizes[batch_size] += 1
+            self._flush_status_messages()
+            self.metrics.handled()
+        return batch_size
+
+    def _receive_datagram(self, data, client_address):
+        self._apply_datagram(data, client_address)
+
+    def _handle_datagram(self, data, client_address):
+        self._apply_datagram(data, client_address)
+        self._flush_status_messages()
+
+    def _apply_datagram(self, data, client_address):
+        data_list = list(data)
+
+        error = self._process_data(data_list, client_address)
+
+        if error is not None:
+            print(f"Error: {ERROR_DICT[error]}")
+            self._send_error_message(error, client_address)
+        elif self.recorder is not None and data_list[0] in (JOIN, QUIT):
+            self.recorder.record(self.loop.time(), MESSAGE, client_address, data)
+
+    def _flush_status_messages(self):
+        # With a tick rate, updates are sent by _on_tick instead.
+        if self.tick_interval is None:
+            rooms, self.touched_rooms = self.touched_rooms, set()
+            self.dirty_rooms.clear()
+            self._send_status_message(rooms)
+
+    def get_batch_stats(self):
+        batch_sizes = self.metrics.batch_sizes
+        batches = sum(batch_sizes.values())
+        datagrams = sum(size * count for size, count in batch_sizes.items())
+        return {
+            'batches': batches,
+            'datagrams': datagrams,
+            'mean_batch_size': datagrams / batches if batches else 0.0,
+            'max_batch_size': max(batch_sizes, default=0),
+            'batch_size_histogram': dict(sorted(batch_sizes.items())),
+        }
+
+    def _print_batch_stats(self):
+        stats = self.get_batch_stats()
+        print(f"Received {stats['datagrams']} datagrams in {stats['batches']} batches "
+              f"(mean {stats['mean_batch_size']:.2f}, max {stats['max_batch_size']})")
+
+    # Timers
+    def _start_timers(self):
+        if self.tick_interval is not None:
+            self.loop.call_later(self.tick_interval, self._on_tick, self.loop.time() + self.tick_interval)
+        if self.idle_timeout:
+            self.loop.call_later(self.idle_timeout / 2, self._evict_idle_sessions)
+        if self.metrics_file:
+            self.loop.call_later(self.metrics_interval, self._write_metrics)
+        self.loop.add_signal_handler(signal.SIGUSR1, self.metrics.toggle_profiler)
+        if self.record_path:
+            self._start_recording()
+        if self.ghost_bot is not None:
+            self.loop.call_later(self.ghost_bot_interval, self._on_bot_tick)
+        if self.move_interval is not None:
+            self.loop.call_later(self.move_interval, self._on_move_tick)
+
+    def _on_tick(self, deadline):
+        # Scheduling against the previous deadline keeps the tick rate from drifting.
+        next_deadline = max(deadline + self.tick_interval, self.loop.time())
+        self.loop.call_at(next_deadline, self._on_tick, next_deadline)
+        rooms, self.dirty_rooms = self.dirty_rooms, set()
+        self.touched_rooms.clear()
+        self._send_status_message(rooms)
+
+    def _on_bot_tick(self):
+        # One timer moves the bots of all rooms, so their cost is a table lookup and a move per room.
+        self.loop.call_later(self.ghost_bot_interval, self._on_bot_tick)
+        for room in self.bot_rooms:
+            if room.game.can_move(Player.SPIRIT):
+                direction = self.ghost_bot.next_direction(room.game)
+                if direction is not None:
+                    self._move_ghost_bot(room, direction)
+        self._flush_status_messages()
+
+    def _on_move_tick(self):
+        # Every player with queued moves makes one of them per tick, however fast it sends.
+        self.loop.call_later(self.move_interval, self._on_move_tick)
+        for session in list(self.queued_sessions):
+            if self.sessions.get(session.address) is not session:
+                # The player left, or its match ended, since the moves were queued.
+                session.moves.clear()
+            else:
+                self._apply_player_move(session, *session.moves.popleft())
+            if not session.moves:
+                self.queued_sessions.discard(session)
+        self._flush_status_messages()
+
+    def _evict_idle_sessions(self):
+        self.loop.call_later(self.idle_timeout / 2, self._evict_idle_sessions)
+        for session in self.sessions.idle_sessions(self.loop.time(), self.idle_timeout):
+            self._evict_session(session)
+        self._flush_status_messages()
+
+    def _evict_session(self, session):
+        print(f"Evicting idle client {session.address} from room {session.room.room_id}")
+        if self.recorder is not None:
+            self.recorder.record(self.loop.time(), EVICT, session.address)
+        # An idle client is treated as if it sent QUIT, which also frees player slots stuck in PREGAME.
+        self.touched_rooms.add(session.room)
+        self._process_quit_request(session.room, [QUIT], session.address)
+        self.sessions.remove(session.address)
+
+    def _write_metrics(self):
+        self.loop.call_later(self.metrics_interval, self._write_metrics)
+        try:
+            self.metrics.write(self, self.metrics_file)
+        except OSError as e:
+            print(f'Failed to write metrics to {self.metrics_file}. Error: {e}')
+
+    # Recording
+    def _start_recording(self):
+        try:
+            self.recorder = Recorder(self.record_path)
+        except OSError as e:
+            print(f'Failed to open recording {self.record_path}. Error: {e}. Exiting...')
+            exit()
+        print(f"Recording accepted messages to {self.record_path}")
+        self.loop.call_later(RECORD_FLUSH_INTERVAL, self._flush_recording)
+
+    def _flush_recording(self):
+        self.loop.call_later(RECORD_FLUSH_INTERVAL, self._flush_recording)
+        self.recorder.flush()
+
+    def _stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.records} records to {self.record_path}")
+            self.recorder = None
+
+    # Rooms
+    def _get_room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = Room(room_id, MAP_PATH, self.keyframe_interval)
+            self.rooms[room_id] = room
+        return room
+
+    def _mark_dirty(self, room):
+        self.dirty_rooms.add(room)
+
+    def _release_room_if_empty(self, room):
+        if room.is_empty() and room.game_status == GameStatus.PREGAME:
+            self.rooms.pop(room.room_id, None)
+            self.bot_rooms.discard(room)
+
+    def _start_if_full(self, room):
+        if room.cman is not None and room.has_ghost() and (room.game_status == GameStatus.PREGAME):
+            room.game_status = GameStatus.WAITING
+            room.game.next_round()
+
     # Join requests
     def _process_data(self, data, client_address):
         prefix = _get_data_prefix(data)
         if prefix == ERROR:
             return 1
 
+        if prefix == STATS:
+            return self._process_stats_request(data, client_address)
+
+        if prefix == RELIABLE_MESSAGE:
+            return self._process_reliable_message(data, client_address)
+
+        if prefix == RELIABLE_ACK:
+            return self._process_reliable_ack(data, client_address)
+
         if prefix == JOIN:
             message = self._process_join_request(data, client_address)
             return message
 
-        if not self._verify_participants(client_address):
+        session = self.sessions.touch(client_address, self.loop.time())
+        if session is None:
             return 2
 
+        room = session.room
+        # Acks and heartbeats never trigger a broadcast, or every update would echo back as another one.
+        if prefix == STATE_ACK:
+            return self._process_state_ack(session, data)
+
+        if prefix == HEARTBEAT:
+            return 11 if len(data) != 1 else None
+
         if prefix == PLAYER_MOVEMENT:
-            message = self._process_player_movement_request(data, client_address)
-            return message
+            # A move only touches the room once it is applied, so rejected, dropped and queued moves cost no
+            # broadcast; the ERROR reply is all a rejected move gets.
+            return self._process_player_movement_request(room, data, session)
 
-        message = self._process_quit_request(data, client_address)
+        self.touched_rooms.add(room)
+        message = self._process_quit_request(room, data, client_address)
+        return message
 
     def _process_join_request(self, data, client_address):
-        if len(data) != 2 and data[1] not in [0x00, 0x01, 0x02]:
+        if len(data) not in [2, 4] or data[1] not in [0x00, 0x01, 0x02]:
             return 2
 
-        if self._verify_participants(client_address):
+        session = self.sessions.touch(client_address, self.loop.time())
+        if session is not None:
+            self.touched_rooms.add(session.room)
             return 3
-        
+
+        # A client joining again has moved on from its last match, so its GAME_END need not be retransmitted.
+        self.reliable.cancel(client_address)
         role = data[1]
+        room = self._get_room(_get_room_id(data))
+        self.touched_rooms.add(room)
 
         if role == 0x00:
-            self.watchers.append(client_address)
+            room.watchers[client_address] = self.sessions.add(client_address, role, room, self.loop.time())
+            self._mark_dirty(room)
             return
 
-        message = self._fill_cman_or_ghost(role, client_address)
-        if self.cman is not None and self.ghost is not None and (self.game_status == GameStatus.PREGAME):
-            self.game_status = GameStatus.WAITING
-            self.game.next_round()
+        message = self._fill_cman_or_ghost(room, role, client_address)
+        if message is None:
+            self.sessions.add(client_address, role, room, self.loop.time())
+            self._mark_dirty(room)
+        self._start_if_full(room)
 
         return message
 
-    def _fill_cman_or_ghost(self, role, client_address):
-        if role == 0x01 and not self.cman:
-            print(f"Cman {client_address} joined")
-            self.cman = client_address
+    def _fill_cman_or_ghost(self, room, role, client_address):
+        if role == 0x01 and not room.cman:
+            print(f"Cman {client_address} joined room {room.room_id}")
+            room.cman = client_address
+            if self.ghost_bot is not None and not room.has_ghost():
+                self.loop.call_later(GHOST_BOT_JOIN_DELAY, self._add_ghost_bot, room)
             return
 
-        if role == 0x02 and not self.ghost:
-            print(f"Ghost {client_address} joined")
-            self.ghost = client_address
+        if role == 0x02 and not room.has_ghost():
+            print(f"Ghost {client_address} joined room {room.room_id}")
+            room.ghost = client_address
             return
 
         return 4 if role == 0x01 else 5
 
     # Move requests
-    def _process_player_movement_request(self, data, client_address):
-        if self.game_status == GameStatus.PREGAME:
+    def _process_player_movement_request(self, room, data, session):
+        # The token is taken first, so a flood of invalid moves is not answered with a flood of errors.
+        if self.input_rate is not None and not self._take_input_token(session):
+            self.metrics.moves_dropped['rate_limited'] += 1
+            return
+
+        if room.game_status == GameStatus.PREGAME:
             return 6
 
-        if len(data) != 2 and data[1] not in [0x00, 0x01, 0x02, 0x03]:
+        if len(data) not in [2, 3] or data[1] not in [0x00, 0x01, 0x02, 0x03]:
             return 7
 
-        if client_address in self.watchers:
+        if session.role == 0x00:
             return 8
 
-        player_to_move = Player.CMAN if self.cman == client_address else Player.SPIRIT
+        input_seq = data[2] if len(data) == 3 else None
+        if self.move_interval is None:
+            return self._apply_player_move(session, data[1], input_seq)
 
-        direction_to_move = data[1]
-
-        move_applied, changed_status = self._has_game_change_mode(player_to_move, direction_to_move)
+        if len(session.moves) >= self.move_queue_len:
+            self.metrics.moves_dropped['queue_full'] += 1
+            return
+        session.moves.append((data[1], input_seq))
+        self.queued_sessions.add(session)
+
+    def _take_input_token(self, session):
+        now = self.loop.time()
+        if session.input_bucket is None:
+            session.input_bucket = TokenBucket(self.input_rate, self.input_burst, now)
+        return session.input_bucket.take(now)
+
+    def _apply_player_move(self, session, direction, input_seq):
+        room = session.room
+        self.touched_rooms.add(room)
+        if self.recorder is not None:
+            # Moves are recorded once applied, so a replay needs neither the rate limit nor the queue.
+            move = [PLAYER_MOVEMENT, direction] + ([input_seq] if input_seq is not None else [])
+            self.recorder.record(self.loop.time(), MESSAGE, session.address, bytes(move))
+
+        if input_seq is not None and session.input_ack != input_seq:
+            # The echoed input ack changed even if the move itself is rejected.
+            session.input_ack = input_seq
+            self._mark_dirty(room)
+
+        player_to_move = Player.CMAN if room.cman == session.address else Player.SPIRIT
+        return self._move_player(room, player_to_move, direction)
+
+    def _move_player(self, room, player_to_move, direction_to_move):
+        move_applied, changed_status = self._has_game_change_mode(room, player_to_move, direction_to_move)
+        if move_applied:
+            self._mark_dirty(room)
 
-        if self.game.get_winner() != Player.NONE:
-            self.game_status = GameStatus.END
+        if room.game.get_winner() != Player.NONE:
+            self._end_game(room)
             return
 
-        if self.game_status == GameStatus.PLAYING and changed_status:
-            self.game_status = GameStatus.START
+        if room.game_status == GameStatus.PLAYING and changed_status:
+            room.game_status = GameStatus.START
             return
 
         if move_applied:
-            self.game_status = GameStatus.PLAYING
+            room.game_status = GameStatus.PLAYING
+
+    # Ghost bot
+    def _add_ghost_bot(self, room):
+        # Nothing to do if a ghost client came, the cman left or the room is gone by now.
+        if self.rooms.get(room.room_id) is room and room.cman is not None and not room.has_ghost():
+            self._seat_ghost_bot(room)
+            self._flush_status_messages()
+
+    def _seat_ghost_bot(self, room):
+        print(f"Ghost bot joined room {room.room_id}")
+        if self.recorder is not None:
+            self.recorder.record(self.loop.time(), BOT_JOIN, data=room.room_id.to_bytes(2, 'big'))
+        room.ghost_is_bot = True
+        self.bot_rooms.add(room)
+        self.touched_rooms.add(room)
+        self._mark_dirty(room)
+        self._start_if_full(room)
+
+    def _move_ghost_bot(self, room, direction):
+        if self.recorder is not None:
+            self.recorder.record(self.loop.time(), BOT_MOVE, data=room.room_id.to_bytes(2, 'big') + bytes([direction]))
+        self.touched_rooms.add(room)
+        self._move_player(room, Player.SPIRIT, direction)
+
+    # State acks
+    def _process_state_ack(self, session, data):
+        if len(data) != 3:
+            return 10
+
+        seq = (data[1] << 8) | data[2]
+        if session.acked_seq is None or seq_newer(seq, session.acked_seq):
+            session.acked_seq = seq
+
+    # Reliable messages
+    def _process_reliable_message(self, data, client_address):
+        if len(data) < 4 or data[3] not in [JOIN, QUIT]:
+            return 13
+
+        message = self.reliable.receive(data, client_address)
+        if message is None:
+            return
+        self._apply_datagram(message, client_address)
+        session = self.sessions.get(client_address)
+        if message[0] == JOIN and session is not None:
+            session.reliable = True
+
+    def _process_reliable_ack(self, data, client_address):
+        if len(data) != 3:
+            return 13
+
+        self.reliable.acked(client_address, (data[1] << 8) | data[2])
+
+    # Stats
+    def _process_stats_request(self, data, client_address):
+        if not client_address[0].startswith('127.'):
+            return 12
+
+        snapshot = json.dumps(self.metrics.snapshot(self), separators=(',', ':'))
+        self._send_message(bytes([STATS_REPLY]) + snapshot.encode(), client_address)
 
     # Quit
-    def _process_quit_request(self, data, client_address):
+    def _process_quit_request(self, room, data, client_address):
         if len(data) > 1:
             return 9
 
-        if client_address in self.watchers:
-            self.watchers.remove(client_address)
+        if client_address in room.watchers:
+            del room.watchers[client_address]
+            self.sessions.remove(client_address)
+            self._release_room_if_empty(room)
+            return
 
-        if self.game_status == GameStatus.PREGAME:
-            if client_address == self.cman:
-                self.cman = None
+        if room.game_status == GameStatus.PREGAME:
+            if client_address == room.cman:
+                room.cman = None
             else:
-                self.ghost = None
+                room.ghost = None
+            self.sessions.remove(client_address)
+            self._release_room_if_empty(room)
         else:
-            winner = 1 if client_address == self.cman else 0
-            self.game.declare_winner(winner)
-            self.game_status = GameStatus.END
+            winner = 1 if client_address == room.cman else 0
+            room.game.declare_winner(winner)
+            self._end_game(room)
 
     def _verify_participants(self, client_address):
-        return self.cman == client_address or self.ghost == client_address or client_address in self.watchers
-
-    def _send_status_message(self):
-        if self.game_status == GameStatus.END:
-            self._send_winning_status()
-            return
-        self._send_game_stats()
-
-    def _send_winning_status(self):
-        print("Sending winning status")
-        winner = 0x01 if self.game.get_winner() == 0 else 0x02
-        lives, score = self.game.get_game_progress()
+        return client_address in self.sessions
+
+    def _send_status_message(self, rooms):
+        if rooms and self.recorder is not None:
+            self.recorder.record(self.loop.time(), BROADCAST)
+        # Ended rooms are not among them: _end_game resets a room at once, without waiting for a batch or a tick.
+        for room in rooms:
+            self._send_game_stats(room)
+
+    def _end_game(self, room):
+        # GAME_END goes out and the room is reset right away rather than with the next broadcast, so a JOIN
+        # later in the same batch finds the seats free.
+        room.game_status = GameStatus.END
+        self.touched_rooms.discard(room)
+        self.dirty_rooms.discard(room)
+        self._send_winning_status(room)
+
+    def _send_winning_status(self, room):
+        print(f"Sending winning status in room {room.room_id}")
+        winner = 0x01 if room.game.get_winner() == 0 else 0x02
+        lives, score = room.game.get_game_progress()
 
         message = _create_bytes_message(GAME_END, winner, _lives_to_catches(lives), score)
 
-        players = [self.cman, self.ghost]
-
-        for _ in range(10):
-            for watcher in self.watchers:
-                self._send_message(message, watcher)
-
-            for player in players:
-                if player is not None:
-                    self._send_message(message, player)
-
-            time.sleep(1.0)
-
-        print("Game ended. New game starting...")
-        self.game.restart_game()
-        self.ghost = None
-        self.cman = None
-        self.watchers = []
-
-        self.game_status = GameStatus.PREGAME
+        recipients = room.participants()
+        self.metrics.fanout[len(recipients)] += 1
+        # Only clients that speak the reliable envelope ack GAME_END; the others get it the original way.
+        reliable_recipients = [recipient for recipient in recipients if self.sessions.get(recipient).reliable]
+        plain_recipients = [recipient for recipient in recipients if recipient not in reliable_recipients]
+        print(f"Game ended in room {room.room_id}. New game starting...")
+        self._reset_room(room)
+
+        for recipient in reliable_recipients:
+            self.reliable.send(message, recipient)
+        if plain_recipients:
+            self._repeat_game_end(message, plain_recipients, GAME_END_REPEATS)
+
+    def _repeat_game_end(self, message, recipients, repeats_left):
+        for recipient in recipients:
+            # Someone who already joined the next match must not be told it ended.
+            if recipient not in self.sessions:
+                self._send_message(message, recipient)
+
+        if repeats_left > 1:
+            self.loop.call_later(GAME_END_INTERVAL, self._repeat_game_end, message, recipients, repeats_left - 1)
+
+    def _reset_room(self, room):
+        for participant in room.participants():
+            self.sessions.remove(participant)
+        room.game.restart_game()
+        room.ghost = None
+        room.ghost_is_bot = False
+        self.bot_rooms.discard(room)
+        room.cman = None
+        room.watchers = {}
+
+        room.game_status = GameStatus.PREGAME
+        self._release_room_if_empty(room)
 
     def _send_error_message(self, error, client):
         message = _create_bytes_message(ERROR, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, error)
+        self.metrics.errors[error] += 1
         self._send_message(message, client)
 
-    def _send_game_stats(self):
+    def _send_game_stats(self, room):
         freeze_status_list = [GameStatus.PREGAME, GameStatus.WAITING, GameStatus.START]
-        should_cman_freeze = 0x01 if self.game_status == GameStatus.PREGAME else 0x00
-        should_ghost_freeze = 0x01 if self.game_status in freeze_status_list else 0x00
+        should_cman_freeze = 0x01 if room.game_status == GameStatus.PREGAME else 0x00
+        should_ghost_freeze = 0x01 if room.game_status in freeze_status_list else 0x00
 
-        lives, _ = self.game.get_game_progress()
-        attempts = _lives_to_catches(lives)
+        room.state_encoder.encode(room.game)
+        room.delta_encoder.update(room.game)
+        self.metrics.fanout[len(room.watchers) + (room.cman is not None) + (room.ghost is not None)] += 1
 
-        cords = self.game.get_current_players_coords()
-        cman_cords, ghost_cords = cords[0], cords[1]
+        for watcher in room.watchers.values():
+            self._send_state(room, watcher, 0x01)
 
-        points = self.game.get_points()
-        converted_points = _convert_point_map_to_byte_stream(points)
+        if room.cman is not None:
+            self._send_state(room, self.sessions.get(room.cman), should_cman_freeze)
 
-        for watcher in self.watchers:
-            message = _create_bytes_message(GAME_STATE_UPDATE, 0x01, *cman_cords, *ghost_cords, attempts, *converted_points)
-            self._send_message(message, watcher)
+        if room.ghost is not None:
+            self._send_state(room, self.sessions.get(room.ghost), should_ghost_freeze)
 
-        if self.cman is not None:
-            cman_message = _create_bytes_message(GAME_STATE_UPDATE, should_cman_freeze, *cman_cords, *ghost_cords, attempts, *converted_points)
-            self._send_message(cman_message, self.cman)
-
-        if self.ghost is not None:
-            ghost_message = _create_bytes_message(GAME_STATE_UPDATE, should_ghost_freeze, *cman_cords, *ghost_cords, attempts, *converted_points)
-            self._send_message(ghost_message, self.ghost)
+    def _send_state(self, room, session, freeze):
+        # Clients that never acked a state get the full GAME_STATE_UPDATE, the rest a delta from their ack.
+        if session.acked_seq is None:
+            message = room.state_encoder.set_freeze(freeze)
+        else:
+            message = room.delta_encoder.encode(session.acked_seq)
+            message[DELTA_FREEZE_OFFSET] = freeze
+            message[DELTA_INPUT_ACK_OFFSET] = session.input_ack
+        self._send_message(message, session.address)
 
     def _send_message(self, message, client):
+        self.metrics.sent(message)
         try:
             self.server_socket.sendto(message, client)
         except socket.error as e:
             print(f'Failed to send message to {client}. Error: {e}\nExiting...')
             exit()
 
-    def _has_game_change_mode(self, player_to_move, direction_to_move):
-        before_lives, _ = self.game.get_game_progress()
-        move_applied = self.game.apply_move(player_to_move, direction_to_move)
-        after_lives, _ = self.game.get_game_progress()
+    def _has_game_change_mode(self, room, player_to_move, direction_to_move):
+        before_lives, _ = room.game.get_game_progress()
+        move_applied = room.game.apply_move(player_to_move, direction_to_move)
+        after_lives, _ = room.game.get_game_progress()
         return move_applied, before_lives != after_lives
 
 
@@ -252,11 +608,27 @@ def _get_data_prefix(data):
         return JOIN
     elif prefix == PLAYER_MOVEMENT:
         return PLAYER_MOVEMENT
+    elif prefix == STATE_ACK:
+        return STATE_ACK
+    elif prefix == HEARTBEAT:
+        return HEARTBEAT
+    elif prefix == STATS:
+        return STATS
+    elif prefix == RELIABLE_MESSAGE:
+        return RELIABLE_MESSAGE
+    elif prefix == RELIABLE_ACK:
+        return RELIABLE_ACK
     elif prefix == QUIT:
         return QUIT
     return ERROR
 
 
+def _get_room_id(data):
+    if len(data) == 4:
+        return (data[2] << 8) | data[3]
+    return DEFAULT_ROOM
+
+
 def _create_bytes_message(*args):
     return bytes(args)
 
@@ -272,4 +644,3 @@ def _convert_point_map_to_byte_stream(points_dict):
 
 def _lives_to_catches(lives):
     return MAX_ATTEMPTS - lives
-
@@ -0,0 +1,98 @@
+from collections import OrderedDict, deque
+
+
+class Session:
+    """
+
+    Everything the server tracks about one client address.
+
+    """
+
+    def __init__(self, address, role, room, now):
+        self.address = address
+        self.role = role
+        self.room = room
+        self.last_seen = now
+        # Last state sequence number the client acknowledged, None until it asks for deltas.
+        self.acked_seq = None
+        # Last PLAYER_MOVEMENT input sequence number received, echoed back in deltas.
+        self.input_ack = 0
+        # Limits the moves accepted from this address, when the server rate limits input.
+        self.input_bucket = None
+        # (direction, input sequence number or None) of the moves waiting for the server's move tick.
+        self.moves = deque()
+        # Whether the client joined with a reliable envelope, and so acks what the server sends reliably.
+        self.reliable = False
+
+
+class TokenBucket:
+    """
+
+    Allows rate events a second on average, in bursts of up to burst events.
+
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Returns whether an event may happen now, using up a token if so."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SessionTable:
+    """
+
+    Sessions keyed by client address, kept in least-recently-seen order.
+
+    Lookups and touches are O(1), and finding idle sessions only walks the ones that are actually idle.
+
+    """
+
+    def __init__(self):
+        self.sessions = OrderedDict()
+
+    def __contains__(self, address):
+        return address in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions.values())
+
+    def get(self, address):
+        return self.sessions.get(address)
+
+    def add(self, address, role, room, now):
+        session = Session(address, role, room, now)
+        self.sessions[address] = session
+        return session
+
+    def remove(self, address):
+        return self.sessions.pop(address, None)
+
+    def touch(self, address, now):
+        session = self.sessions.get(address)
+        if session is not None:
+            session.last_seen = now
+            self.sessions.move_to_end(address)
+        return session
+
+    def idle_sessions(self, now, timeout):
+        idle = []
+        for session in self.sessions.values():
+            if now - session.last_seen < timeout:
+                break
+            idle.append(session)
+        return idle
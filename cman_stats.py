@@ -0,0 +1,32 @@
+import json
+import socket
+import sys
+
+from arg_parser import ArgParser as ap
+from consts import STATS, STATS_REPLY, ERROR, ERROR_DICT
+
+REPLY_TIMEOUT = 2.0
+# The reply is a JSON document, larger than the game's messages.
+REPLY_BUFFER_SIZE = 65536
+
+
+def main():
+    addr, port = ap().stats_parse_arguments()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
+        client_socket.settimeout(REPLY_TIMEOUT)
+        client_socket.sendto(bytes([STATS]), (addr, port))
+        try:
+            data, _ = client_socket.recvfrom(REPLY_BUFFER_SIZE)
+        except socket.timeout:
+            print(f"No answer from {addr}:{port}")
+            sys.exit(1)
+
+    if data[0] == ERROR:
+        print(f"Error: {ERROR_DICT[data[-1]]}")
+        sys.exit(1)
+    if data[0] == STATS_REPLY:
+        print(json.dumps(json.loads(data[1:]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import os
 import sys
 import tty
 import termios
 import select
+from contextlib import contextmanager
 
 def _flush_input():
     try:
@@ -46,6 +48,31 @@ def get_pressed_keys(keys_filter=None):
         return [ch] if ch in keys_filter else []
     return [ch] if ch else []
 
+@contextmanager
+def cbreak_terminal():
+    """
+
+    Puts standard input in cbreak mode (no line buffering, no echo) until the block exits.
+
+    Unlike get_single_char, the mode is switched once, so keys can be read whenever stdin is readable.
+
+    """
+    fd = sys.stdin.fileno()
+    old_settings = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+def read_pressed_keys():
+    """
+
+    Returns the keys waiting on standard input. Only call it once stdin is readable, inside cbreak_terminal().
+
+    """
+    return list(os.read(sys.stdin.fileno(), 64).decode(errors='ignore'))
+
 def clear_print(*args, **kwargs):
     """
 
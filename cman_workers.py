@@ -0,0 +1,216 @@
+import os
+import signal
+import socket
+import time
+import traceback
+
+from consts import BUFFER_SIZE, JOIN, QUIT, RELIABLE_MESSAGE
+from cman_reliable import ENVELOPE_HEADER_LEN
+from cman_server_impl import CManServer, _get_room_id
+
+# How long the launcher waits for workers to drain before killing them.
+SHUTDOWN_TIMEOUT = 5.0
+# How often an owner tells the forwarding workers which of their routes lead nowhere anymore, in seconds.
+ROUTE_SWEEP_INTERVAL = 5.0
+# Forwarded datagrams start with the client's ip and port. A header alone ends the client's route.
+PEER_HEADER_LEN = 6
+
+
+class WorkerServer(CManServer):
+    """
+
+    One of several server processes bound to the same port with SO_REUSEPORT.
+
+    The kernel hashes every client address to one worker, but the cman and the ghost of a match
+    may hash to different workers. Rooms are therefore owned by worker (room_id % worker_count), and
+    a worker that receives a datagram for a room it does not own relays it to the owner over a private
+    loopback socket. The owner answers through its own SO_REUSEPORT socket, so replies still come from
+    the public port. Once a forwarded client has no session and nothing left to retransmit to it, the
+    owner tells the forwarding worker to drop its route.
+
+    """
+
+    def __init__(self, port, worker_id, peer_socket, peer_addresses, **server_options):
+        super().__init__(port, **server_options)
+        self.worker_id = worker_id
+        self.worker_count = len(peer_addresses)
+        self.peer_socket = peer_socket
+        self.peer_addresses = peer_addresses
+        self.peer_ids = {address: peer_id for peer_id, address in enumerate(peer_addresses)}
+        # Client address -> id of the worker its datagrams are forwarded to.
+        self.forwarded_clients = {}
+        # Client address -> id of the worker that forwards its datagrams here.
+        self.forwarders = {}
+        self.peer_socket.setblocking(False)
+        if self.metrics_file:
+            self.metrics_file = f'{self.metrics_file}.{worker_id}'
+        if self.record_path:
+            self.record_path = f'{self.record_path}.{worker_id}'
+
+    def _create_socket(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        return server_socket
+
+    def start_game(self):
+        print(f"Worker {self.worker_id} (pid {os.getpid()}) is serving rooms {self.worker_id} mod {self.worker_count}")
+        self.loop.add_reader(self.peer_socket, self._on_peer_readable)
+        self.loop.add_signal_handler(signal.SIGTERM, self.loop.stop)
+        self.loop.add_signal_handler(signal.SIGINT, self.loop.stop)
+        self._start_timers()
+        self.loop.call_later(ROUTE_SWEEP_INTERVAL, self._sweep_routes)
+        try:
+            self.loop.add_reader(self.server_socket, self._on_readable)
+            self.loop.run_forever()
+            self._drain()
+        finally:
+            self._print_batch_stats()
+            self._stop_recording()
+            self.loop.remove_reader(self.server_socket)
+            self.loop.remove_reader(self.peer_socket)
+            self.loop.close()
+            self.server_socket.close()
+            self.peer_socket.close()
+            print(f"Worker {self.worker_id} stopped")
+
+    def _drain(self):
+        # Handle whatever is already queued before the sockets are closed.
+        while self._on_readable():
+            pass
+        while self._on_peer_readable():
+            pass
+
+    def _receive_datagram(self, data, client_address):
+        owner = self._owner_of(data, client_address)
+        if owner == self.worker_id:
+            self._apply_datagram(data, client_address)
+            return
+
+        self._forward(owner, data, client_address)
+
+    def _on_peer_readable(self):
+        batch_size = 0
+        while batch_size < self.recv_budget:
+            try:
+                packet, peer_address = self.peer_socket.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            batch_size += 1
+            client_address = (socket.inet_ntoa(packet[:4]), int.from_bytes(packet[4:6], 'big'))
+            peer_id = self.peer_ids[peer_address]
+            if len(packet) == PEER_HEADER_LEN:
+                self._end_route(client_address, peer_id)
+                continue
+            self.forwarders[client_address] = peer_id
+            self.metrics.received(packet[PEER_HEADER_LEN:], forwarded=True)
+            self._apply_datagram(packet[PEER_HEADER_LEN:], client_address)
+
+        if batch_size:
+            self._flush_status_messages()
+            self.metrics.handled()
+        return batch_size
+
+    def _owner_of(self, data, client_address):
+        reliable = len(data) > ENVELOPE_HEADER_LEN and data[0] == RELIABLE_MESSAGE
+        message = data[ENVELOPE_HEADER_LEN:] if reliable else data
+        if len(message) and message[0] == JOIN:
+            if self._verify_participants(client_address):
+                return self.worker_id
+            owner = _get_room_id(message) % self.worker_count
+            if owner == self.worker_id:
+                self.forwarded_clients.pop(client_address, None)
+            else:
+                self.forwarded_clients[client_address] = owner
+            return owner
+
+        owner = self.forwarded_clients.get(client_address, self.worker_id)
+        # A reliable QUIT keeps its route, so its retransmits and the client's acks still reach the owner.
+        if len(data) == 1 and data[0] == QUIT:
+            self.forwarded_clients.pop(client_address, None)
+        return owner
+
+    def _forward(self, worker_id, data, client_address):
+        header = socket.inet_aton(client_address[0]) + client_address[1].to_bytes(2, 'big')
+        self.peer_socket.sendto(header + data, self.peer_addresses[worker_id])
+
+    def _sweep_routes(self):
+        # A client still waiting for a reliable message keeps its route, so its acks reach this worker.
+        ended = [address for address in self.forwarders
+                 if address not in self.sessions and address not in self.reliable.pending]
+        for address in ended:
+            self._forward(self.forwarders.pop(address), b'', address)
+        self.loop.call_later(ROUTE_SWEEP_INTERVAL, self._sweep_routes)
+
+    def _end_route(self, client_address, owner):
+        # The client may have joined a room of another worker since the owner looked.
+        if self.forwarded_clients.get(client_address) == owner:
+            del self.forwarded_clients[client_address]
+
+
+def run_workers(port, worker_count, server_options):
+    """
+
+    Forks worker_count server processes sharing port and waits for them. server_options are passed
+    on to every WorkerServer.
+
+    SIGINT or SIGTERM to the launcher is relayed to every worker, which drains its socket and exits.
+
+    """
+    peer_sockets = []
+    for _ in range(worker_count):
+        peer_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer_socket.bind(('127.0.0.1', 0))
+        peer_sockets.append(peer_socket)
+    peer_addresses = [peer_socket.getsockname() for peer_socket in peer_sockets]
+
+    pids = []
+    for worker_id in range(worker_count):
+        pid = os.fork()
+        if pid == 0:
+            for other_id, peer_socket in enumerate(peer_sockets):
+                if other_id != worker_id:
+                    peer_socket.close()
+            exit_code = 0
+            try:
+                WorkerServer(port, worker_id, peer_sockets[worker_id], peer_addresses, **server_options).start_server()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        pids.append(pid)
+
+    for peer_socket in peer_sockets:
+        peer_socket.close()
+
+    print(f"Started {worker_count} workers on port {port}")
+    _wait_for_workers(pids)
+
+
+def _wait_for_workers(pids):
+    alive = set(pids)
+    deadline = None
+
+    def shutdown(signum, frame):
+        nonlocal deadline
+        if deadline is None:
+            print("\nStopping workers...")
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for pid in alive:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    while alive:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            alive.discard(pid)
+            continue
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in alive:
+                os.kill(pid, signal.SIGKILL)
+            deadline = float('inf')
+        time.sleep(0.1)
+
+    print("All workers stopped")
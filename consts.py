@@ -1,12 +1,28 @@
 SERVER_ADDR = '0.0.0.0'
 DEFAULT_PORT = 1337
+DEFAULT_RELAY_PORT = 1338
 BUFFER_SIZE = 1024
+DEFAULT_ROOM = 0
+DEFAULT_RECV_BUDGET = 64
+DEFAULT_MOVE_QUEUE_LEN = 4
+DEFAULT_INPUT_BURST = 10
+# Clients send a HEARTBEAT after this many seconds without sending anything else.
+HEARTBEAT_INTERVAL = 5.0
 
 #OPCODE
 JOIN = 0x00
 PLAYER_MOVEMENT = 0x01
+STATE_ACK = 0x02
+HEARTBEAT = 0x03
+STATS = 0x04
+RELIABLE_MESSAGE = 0x05
+RELIABLE_ACK = 0x06
 QUIT = 0x0F
 GAME_STATE_UPDATE = 0x80
+GAME_STATE_DELTA = 0x81
+STATS_REPLY = 0x84
+SERVER_RELIABLE_MESSAGE = 0x85
+SERVER_RELIABLE_ACK = 0x86
 GAME_END = 0x8F
 ERROR = 0xFF
 
@@ -22,7 +38,11 @@ ERROR_DICT = [
     "Game not started yet, can't move",
     'bad format error, move is not correct',
     'Non players are not allowed to send move commands',
-    'bad format error, quit request is not correct'
+    'bad format error, quit request is not correct',
+    'bad format error, state ack is not correct',
+    'bad format error, heartbeat is not correct',
+    'Stats are only served to local clients',
+    'bad format error, reliable message is not correct'
 ]
 
 DIRECTION_TO_BYTE = {